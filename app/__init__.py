@@ -6,10 +6,9 @@ from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy_searchable import make_searchable
 from flask_cors import CORS
+from app.cache import PageCache, SearchCache, UserCache, init_fragment_cache
+from app.mail_queue import MailQueue
 
-import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
-import os
 from config import Config
 
 db = SQLAlchemy()
@@ -18,7 +17,11 @@ login = LoginManager()
 login.login_view = 'cms.login'
 login.login_message = 'You must be logged in to access this page.'
 mail = Mail()
+mail_queue = MailQueue()
 moment = Moment()
+page_cache = PageCache()
+search_cache = SearchCache()
+user_cache = UserCache()
 
 @migrate.configure
 def configure_alembic(config):
@@ -33,10 +36,27 @@ def create_app(config_class = Config):
     migrate.init_app(app, db)
     login.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
     moment.init_app(app)
+    page_cache.init_app(app)
+    search_cache.init_app(app)
+    user_cache.init_app(app)
+    init_fragment_cache(app)
     CORS(app)
     db.configure_mappers()
 
+    from app import query_budget, conditional, search, compiler, render, metrics, slow_queries, assets, compression, freeze
+    query_budget.init_app(app)
+    metrics.init_app(app)
+    slow_queries.init_app(app)
+    compression.init_app(app)
+    conditional.init_app(app)
+    search.init_app(app)
+    compiler.init_app(app)
+    render.init_app(app)
+    assets.init_app(app)
+    freeze.init_app(app)
+
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
 
@@ -47,35 +67,8 @@ def create_app(config_class = Config):
     app.register_blueprint(cms_bp, url_prefix='/cms')
 
     if not app.debug and not app.testing:
-        if app.config['MAIL_SERVER']:
-            auth = None
-
-            if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-                auth = (app.config['MAIL_USERNAME'],
-                        app.config['MAIL_PASSWORD'])
-
-            secure = None
-            if app.config['MAIL_USE_TLS']:
-                secure = ()
-
-            mail_handler = SMTPHandler(
-                mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-                fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-                toaddrs=app.config['ADMINS'], subject='Precisamento Failure',
-                credentials=auth, secure=secure)
-
-            mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
-
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-
-        file_handler = RotatingFileHandler('logs/blog.log', maxBytes=10240, backupCount=10)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s [in %(pathname)s:%(lineno)d'))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-
-        app.logger.setLevel(logging.INFO)
+        from app import logs
+        logs.init_app(app)
         app.logger.info('Blog startup')
 
     return app
@@ -0,0 +1,159 @@
+from flask import send_from_directory
+from flask.cli import AppGroup
+from app.compression import choose_encoding
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import sass
+except ImportError:
+    sass = None
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# Built files live here, under the static folder, beside manifest.json.
+DIST = 'dist'
+
+assets_cli = AppGroup('assets', help='Build the static assets.')
+
+def init_app(app):
+    """
+    With a built manifest, url_for('static') points at the fingerprinted
+    copies of files, which are served precompressed and cached forever.
+    """
+
+    app.cli.add_command(assets_cli)
+
+    path = os.path.join(app.static_folder, DIST, 'manifest.json')
+    if not app.config['ASSETS_FINGERPRINT'] or not os.path.exists(path):
+        return
+
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    built = set(manifest.values())
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = f'{DIST}/{manifest[values["filename"]]}'
+
+    default_static = app.view_functions['static']
+
+    def static(filename):
+        name = filename[len(DIST) + 1:] if filename.startswith(DIST + '/') else None
+        if name not in built:
+            return default_static(filename)
+
+        directory = os.path.join(app.static_folder, DIST)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        encoding = choose_encoding([encoding for encoding, extension in ENCODINGS
+                                    if os.path.exists(os.path.join(directory, name + extension))])
+        if encoding is not None:
+            response = send_from_directory(directory, name + dict(ENCODINGS)[encoding], mimetype=mimetype)
+            response.content_encoding = encoding
+        else:
+            response = send_from_directory(directory, name, mimetype=mimetype)
+
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        return response
+
+    app.view_functions['static'] = static
+
+
+def fingerprint(name, content):
+    root, extension = os.path.splitext(name)
+    # Keep .min.js style double extensions readable: jquery.min.1a2b3c4d.js
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+def _source_files(static_folder):
+    for directory, dirs, files in os.walk(static_folder):
+        relative = os.path.relpath(directory, static_folder).replace(os.sep, '/')
+        if relative == '.':
+            relative = ''
+            dirs[:] = [d for d in dirs if d not in (DIST, 'scss')]
+        elif relative == 'images/avatars':
+            # Uploaded avatars are named by content hash already.
+            dirs[:] = []
+        for name in files:
+            yield f'{relative}/{name}' if relative else name
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+def build(static_folder):
+    """
+    Copies every static file into dist/ under a name containing a hash of
+    its content, with .gz and (when brotli is installed) .br siblings for
+    text files, and writes the manifest mapping the original names to them.
+    Source map comments are pointed at the fingerprinted maps.
+    """
+
+    dist = os.path.join(static_folder, DIST)
+    names = sorted(_source_files(static_folder), key=lambda name: not name.endswith('.map'))
+    manifest = {}
+
+    for name in names:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            content = f.read()
+
+        map_name = name + '.map'
+        if not name.endswith('.map') and map_name in manifest:
+            original = os.path.basename(map_name).encode('utf-8')
+            hashed = os.path.basename(manifest[map_name]).encode('utf-8')
+            content = re.sub(rb'(sourceMappingURL=)' + re.escape(original), rb'\g<1>' + hashed, content)
+
+        manifest[name] = fingerprint(name, content)
+        path = os.path.join(dist, manifest[name])
+        _write(path, content)
+
+        if name.endswith(COMPRESSIBLE):
+            compressed = gzip.compress(content, 9, mtime=0)
+            if len(compressed) < len(content):
+                _write(path + '.gz', compressed)
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    _write(path + '.br', compressed)
+
+    # Fingerprinted files from earlier builds are left for pages still cached by clients.
+    _write(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+@assets_cli.command('build')
+def build_command():
+    """Compile the scss and build the fingerprinted, compressed assets."""
+    from flask import current_app
+    static_folder = current_app.static_folder
+
+    if sass is not None:
+        css = sass.compile(filename=os.path.join(static_folder, 'scss', 'main.scss'),
+                           output_style='compressed',
+                           source_map_filename=os.path.join(static_folder, 'css', 'style.css.map'),
+                           output_filename_hint=os.path.join(static_folder, 'css', 'style.css'))
+        _write(os.path.join(static_folder, 'css', 'style.css'), css[0].encode('utf-8'))
+        _write(os.path.join(static_folder, 'css', 'style.css.map'), css[1].encode('utf-8'))
+        print('Compiled scss/main.scss.')
+    else:
+        print('libsass is not installed, using the existing css/style.css.')
+
+    if brotli is None:
+        print('brotli is not installed, only gzip copies will be made.')
+
+    manifest = build(static_folder)
+    print(f'Built {len(manifest)} assets.')
@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import hashlib
+import io
+import os
+
+class AvatarError(ValueError):
+    pass
+
+def check(stream, max_bytes, max_pixels):
+    """
+    Reads an upload and checks its size, format and dimensions from the
+    header, without decoding the pixels. Returns the uploaded bytes.
+    """
+
+    data = stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise AvatarError(f'Images must be smaller than {max_bytes // (1024 * 1024)} MB.')
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format not in ('PNG', 'JPEG'):
+            raise AvatarError('Must be a PNG or JPEG image.')
+        width, height = image.size
+        if width * height > max_pixels:
+            raise AvatarError('Image dimensions are too large.')
+        image.verify()
+    except (IOError, SyntaxError, Image.DecompressionBombError):
+        raise AvatarError('Error opening or processing image')
+    return data
+
+
+def render(data, directory, sizes, webp_quality):
+    """
+    Writes square PNG and WebP variants of the image at each size, named
+    after a hash of the upload so they can be cached forever, and removes
+    the previous avatar's files. Returns the hash. Runs in a worker process.
+    """
+
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    os.makedirs(directory, exist_ok=True)
+    for size in sorted(sizes, reverse=True):
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for extension, options in (('png', { 'format': 'PNG', 'optimize': True }),
+                                   ('webp', { 'format': 'WEBP', 'quality': webp_quality, 'method': 4 })):
+            path = os.path.join(directory, f'{digest}-{size}.{extension}')
+            variant.save(path + '.tmp', **options)
+            os.replace(path + '.tmp', path)
+
+    for name in os.listdir(directory):
+        if not name.startswith(digest):
+            os.remove(os.path.join(directory, name))
+    return digest
+
+
+_executor = None
+_executor_pid = None
+
+def _get_executor(workers):
+    # A pool inherited through a fork can't be used, so each process makes its own.
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(workers)
+        _executor_pid = os.getpid()
+    return _executor
+
+def submit(app, user_id, data):
+    """
+    Processes a checked upload for the user. With AVATAR_WORKERS set it's
+    done in a process pool and the user is updated when it finishes, so
+    None is returned; otherwise it's done here and the hash is returned.
+    """
+
+    args = (data, os.path.join(app.static_folder, 'images', 'avatars', str(user_id)),
+            tuple(app.config['AVATAR_SIZES']), app.config['AVATAR_WEBP_QUALITY'])
+
+    if not app.config['AVATAR_WORKERS']:
+        return render(*args)
+
+    future = _get_executor(app.config['AVATAR_WORKERS']).submit(render, *args)
+    future.add_done_callback(lambda future: _finished(app, user_id, future))
+    return None
+
+def _finished(app, user_id, future):
+    if future.exception() is not None:
+        app.logger.error(f'Processing the avatar of user {user_id} failed', exc_info=future.exception())
+        return
+
+    from app import db, user_cache
+    from app.models import User
+    with app.app_context():
+        db.session.query(User).filter(User.id == user_id) \
+                  .update({ 'avatar_hash': future.result(), 'has_avatar': True }, synchronize_session=False)
+        db.session.commit()
+        # Bulk updates skip the session events that usually invalidate this.
+        user_cache.delete(user_id)
@@ -0,0 +1,424 @@
+from flask import current_app, has_app_context, g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+def render_generation():
+    """
+    The mtime of the RENDER_GENERATION file, which `flask posts render`
+    touches after re-rendering every post. It's part of the cached pages'
+    versions and the ETags, so workers stop serving the old html without
+    being restarted. Read once per app context.
+    """
+
+    if has_app_context() and 'render_generation' in g:
+        return g.render_generation
+    try:
+        generation = os.stat(current_app.config['RENDER_GENERATION']).st_mtime_ns
+    except FileNotFoundError:
+        generation = 0
+    if has_app_context():
+        g.render_generation = generation
+    return generation
+
+def touch_render_generation():
+    path = current_app.config['RENDER_GENERATION']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        os.utime(path)
+
+
+class CacheStats(object):
+    """
+    Hit/miss counters, recorded by whatever layer decides if a lookup was
+    usable. Only per process, and not locked since they're for tuning.
+    """
+
+    hits = 0
+    misses = 0
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self):
+        return { 'hits': self.hits, 'misses': self.misses }
+
+
+class LRUCache(CacheStats):
+    """
+    In-process cache that evicts the least recently used entries once
+    the pickled size of everything stored goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+        return pickle.loads(item)
+
+    def set(self, key, value):
+        item = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(item) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._items[key] = item
+            self.size += len(item)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(entries=len(self._items), bytes=self.size, max_bytes=self.max_bytes)
+        return stats
+
+    def _remove(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= len(item)
+
+
+class FileSystemCache(CacheStats):
+    """
+    Cache shared by every worker on the host. Each entry is a file; when the
+    directory grows over max_bytes the least recently written files go first.
+
+    Writes only add to a running total of the directory's size. It's
+    scanned when that total goes over max_bytes, or SWEEP_INTERVAL seconds
+    after the last scan to count other workers' writes, and then cut down
+    to LOW_WATER of max_bytes so the next scan is a while off.
+    """
+
+    SWEEP_INTERVAL = 60
+    LOW_WATER = 0.9
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = None
+        self._swept = 0
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        item = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(item) > self.max_bytes:
+            return
+        path = self._file(key)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(item)
+        replaced = _file_size(path)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(item) - replaced
+            if (self._size is None or self._size > self.max_bytes or
+                time.monotonic() - self._swept > self.SWEEP_INTERVAL):
+                self._evict()
+
+    def delete(self, key):
+        path = self._file(key)
+        size = _file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.tmp'):
+                os.remove(entry.path)
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(max_bytes=self.max_bytes)
+        return stats
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.tmp'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(e[1] for e in entries)
+        if size > self.max_bytes:
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_bytes * self.LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+
+        self._size = size
+        self._swept = time.monotonic()
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def make_cache(kind, max_bytes, path=None):
+    if not kind:
+        return None
+    if kind == 'lru':
+        return LRUCache(max_bytes)
+    if kind == 'filesystem':
+        return FileSystemCache(path, max_bytes)
+    raise ValueError(f'Unknown cache type {kind}')
+
+
+class PageCache(object):
+    """
+    Rendered responses keyed by a name (the post slug) and stored with the
+    version they were rendered from (its date_edited and author's name), so
+    a stale page in another worker's cache is never served, along with the
+    render generation. Compressed copies of a page are stored beside it
+    under the encoding's name.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['page_cache'] = make_cache(app.config['PAGE_CACHE_TYPE'],
+                                                  app.config['PAGE_CACHE_MAX_BYTES'],
+                                                  app.config['PAGE_CACHE_DIR'])
+
+        from app.models import posts_committed
+        posts_committed.connect(_invalidate_posts, weak=False)
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('page_cache')
+
+    @staticmethod
+    def key(name, encoding):
+        return name if encoding is None else f'{name}.{encoding}'
+
+    def get(self, name, version, encoding=None):
+        if self.backend is None:
+            return None
+        item = self.backend.get(self.key(name, encoding))
+        hit = item is not None and item[0] == (render_generation(), version)
+        self.backend.record(hit)
+        return item[1] if hit else None
+
+    def set(self, name, version, page, encoding=None):
+        if self.backend is not None:
+            self.backend.set(self.key(name, encoding), ((render_generation(), version), page))
+
+    def delete(self, name):
+        if self.backend is not None:
+            for encoding in (None, 'br', 'gzip'):
+                self.backend.delete(self.key(name, encoding))
+
+
+class SearchCache(object):
+    """
+    Ordered post ids of a search, keyed by its normalized terms, so every
+    page of the results is a slice instead of a new search. Entries expire
+    after SEARCH_CACHE_TTL seconds, which bounds how stale other workers'
+    caches get, and this worker's cache is cleared whenever posts change.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['search_cache'] = make_cache(app.config['SEARCH_CACHE_TYPE'],
+                                                    app.config['SEARCH_CACHE_MAX_BYTES'],
+                                                    app.config['SEARCH_CACHE_DIR'])
+
+        from app.models import posts_committed
+        posts_committed.connect(_clear_searches, weak=False)
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('search_cache')
+
+    @staticmethod
+    def key(query, tags, match_all):
+        tags = tuple(sorted(set(tags)))
+        return repr((' '.join(query.lower().split()), tags, match_all and len(tags) > 1))
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        item = self.backend.get(key)
+        hit = item is not None and item[0] > time.time()
+        self.backend.record(hit)
+        return item[1] if hit else None
+
+    def set(self, key, ids):
+        if self.backend is not None:
+            self.backend.set(key, (time.time() + current_app.config['SEARCH_CACHE_TTL'], ids))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+class UserCache(object):
+    """
+    Column values of recently loaded users, so the user loader doesn't
+    query on every authenticated request. Entries expire after
+    USER_CACHE_TTL seconds, which bounds how stale other workers' caches
+    get, and this worker drops a user as soon as a change to it commits.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['user_cache'] = make_cache(app.config['USER_CACHE_TYPE'],
+                                                  app.config['USER_CACHE_MAX_BYTES'],
+                                                  app.config['USER_CACHE_DIR'])
+
+        from app.models import users_committed
+        users_committed.connect(_forget_users, weak=False)
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('user_cache')
+
+    def get(self, id):
+        if self.backend is None:
+            return None
+        item = self.backend.get(f'user/{id}')
+        hit = item is not None and item[0] > time.time()
+        self.backend.record(hit)
+        return item[1] if hit else None
+
+    def set(self, id, values):
+        if self.backend is not None:
+            self.backend.set(f'user/{id}', (time.time() + current_app.config['USER_CACHE_TTL'], values))
+
+    def delete(self, id):
+        if self.backend is not None:
+            self.backend.delete(f'user/{id}')
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Caches the rendered output of a template block under the values
+    given to the tag, which should include everything the block shows
+    that can change:
+
+        {% cache 'post', post.id, post.date_edited, post.author.name %}
+            ...
+        {% endcache %}
+
+    The render generation is added to the key.
+    """
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(key)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        backend = current_app.extensions.get('fragment_cache')
+        if backend is None:
+            return caller()
+
+        key = repr((render_generation(), key))
+        fragment = backend.get(key)
+        backend.record(fragment is not None)
+        if fragment is None:
+            fragment = str(caller())
+            backend.set(key, fragment)
+        return Markup(fragment)
+
+
+def init_fragment_cache(app):
+    app.extensions['fragment_cache'] = make_cache(app.config['FRAGMENT_CACHE_TYPE'],
+                                                  app.config['FRAGMENT_CACHE_MAX_BYTES'],
+                                                  app.config['FRAGMENT_CACHE_DIR'])
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def cache_stats(app):
+    return { name: app.extensions[name].stats()
+             for name in ('page_cache', 'fragment_cache', 'search_cache', 'highlight_cache', 'user_cache')
+             if app.extensions.get(name) is not None }
+
+
+def _invalidate_posts(sender, changes):
+    from app import page_cache
+    for change in changes:
+        for slug in [change.slug] + change.old_slugs:
+            page_cache.delete(f'blog/{slug}')
+
+
+def _clear_searches(sender, changes):
+    from app import search_cache
+    search_cache.clear()
+
+
+def _forget_users(sender, user_ids):
+    from app import user_cache
+    for id in user_ids:
+        user_cache.delete(id)
@@ -2,8 +2,9 @@ from flask_wtf import FlaskForm, RecaptchaField
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, TextAreaField, SubmitField, IntegerField, BooleanField, PasswordField
 from wtforms.validators import ValidationError, DataRequired, Length, Email, EqualTo
+from flask import current_app
 from app.models import User, Post
-from PIL import Image
+from app.avatars import check as check_avatar, AvatarError
 
 class PostForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired()])
@@ -43,10 +44,11 @@ class UserForm(FlaskForm):
     submit = SubmitField('Save Changes')
 
     def validate_avatar(self, avatar):
-        if avatar.data is not None:
+        # Only the header is checked here; resizing happens off the request.
+        if avatar.data:
             try:
-                self.image = Image.open(avatar.data.stream)
-                if self.image.size != (200, 200):
-                    self.image = image.resize((200, 200))
-            except(IOError, ValueError):
-                raise ValidationError('Error opening or processing image')
\ No newline at end of file
+                self.avatar_bytes = check_avatar(avatar.data.stream,
+                                                 current_app.config['AVATAR_MAX_BYTES'],
+                                                 current_app.config['AVATAR_MAX_PIXELS'])
+            except AvatarError as e:
+                raise ValidationError(str(e))
\ No newline at end of file
@@ -1,16 +1,15 @@
-from flask import render_template, redirect, url_for, flash, request, current_app
+from flask import render_template, redirect, url_for, flash, request, current_app, jsonify, abort, Response
 from werkzeug import secure_filename
 from werkzeug.urls import url_parse
 from flask_login import login_user, logout_user, current_user, login_required
-from app import db
+from app import db, metrics, avatars
 from app.cms import bp
 from app.cms.forms import LoginForm, RegistrationForm, PostForm, UserForm
 from app.models import UserLevel, User, Post, Tag
 from app.email import send_email
-from pyquery import PyQuery as pq
+from app.cache import cache_stats
 from datetime import datetime
 from time import time
-import os
 
 import jwt
 
@@ -111,11 +110,12 @@ def edit_profile():
         user.name = form.name.data
         user.about_me = form.about_me.data
         if form.avatar.data:
-            path = f'app/static/images/avatars/{user.id}'
-            if not os.path.exists(path):
-                os.makedirs(path)
-            form.image.save(f'{path}/avatar.png')
-            user.has_avatar = True
+            avatar_hash = avatars.submit(current_app._get_current_object(), user.id, form.avatar_bytes)
+            if avatar_hash == None:
+                flash('Your new avatar will show up in a moment.')
+            else:
+                user.avatar_hash = avatar_hash
+                user.has_avatar = True
         db.session.commit()
         return redirect(url_for('main.member', username=user.username))
 
@@ -125,15 +125,9 @@ def edit_profile():
     if user.about_me:
         form.about_me.data = user.about_me
 
-    if user.has_avatar:
-        avatar = url_for('static', filename=f'images/avatars/{user.id}/avatar.png')
-    else:
-        avatar = url_for('static', filename='images/avatars/default.svg')
-
     return render_template('edit_profile.html', 
                            title='Edit Profile', 
                            form=form, 
-                           avatar=avatar,
                            user=user)
     
 
@@ -141,16 +135,9 @@ def fill_post_from_form(post, form):
     post.title = form.title.data
     post.markdown_body = form.body.data
     post.tags = Tag.validate_tags(form.tags.data)
+    post.summary = form.summary.data or None
     post.prepare_to_save()
 
-    if not form.summary.data:
-        html = pq(post.html_body)
-        first_para = html('p:first')
-        if first_para:
-            post.summary = first_para[0].text
-    else:
-        post.summary = form.summary.data
-
     if post.author == None:
         post.author = current_user
     else:
@@ -180,7 +167,7 @@ def blog_edit():
     if post_id == -1:
         return redirect(url_for('main.index'))
 
-    post = Post.query.filter_by(id=post_id).first()
+    post = Post.query.with_body().filter_by(id=post_id).first()
 
     if post == None or (current_user.level != UserLevel.admin and post.author != current_user):
         return redirect(url_for('main.index'))
@@ -198,4 +185,20 @@ def blog_edit():
     form.title.data = post.title
     form.body.data = post.markdown_body
     form.tags.data = ' '.join(map(lambda t: t.title, post.tags))
-    return render_template('blog_create.html', title='Edit Blog', form=form)
\ No newline at end of file
+    return render_template('blog_create.html', title='Edit Blog', form=form)
+
+@bp.route('/cache_stats')
+@login_required
+def cache_statistics():
+    if current_user.level != UserLevel.admin:
+        return redirect(url_for('main.index'))
+    return jsonify(cache_stats(current_app))
+
+@bp.route('/metrics')
+@login_required
+def metrics_page():
+    if current_user.level != UserLevel.admin:
+        return redirect(url_for('main.index'))
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics.expose(current_app, db), mimetype='text/plain; version=0.0.4')
\ No newline at end of file
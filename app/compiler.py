@@ -0,0 +1,169 @@
+from flask import current_app
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite, HiliteTreeprocessor, parse_hl_lines
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import HTML_PLACEHOLDER_RE, INLINE_PLACEHOLDER_RE
+from app.cache import make_cache
+from threading import local
+import hashlib
+import re
+
+WORDS_PER_MINUTE = 200
+
+class CompiledPost(object):
+    def __init__(self, slug, html, summary, word_count, toc):
+        self.slug = slug
+        self.html = html
+        self.summary = summary
+        self.word_count = word_count
+        self.toc = toc
+
+
+class PostStatsTreeprocessor(Treeprocessor):
+    """
+    Runs once the inline markup has been processed and collects the first
+    paragraph's text and the word count, so the rendered html never has to
+    be parsed again.
+    """
+
+    def run(self, root):
+        self.md.post_summary = None
+        self.md.post_word_count = _count_words(root)
+
+        for element in root:
+            if element.tag == 'p':
+                summary = _strip_placeholders(''.join(element.itertext())).strip()
+                if summary:
+                    self.md.post_summary = summary
+                    break
+
+
+class PostStatsExtension(Extension):
+    def extendMarkdown(self, md):
+        # After inline (20) so text is final, after toc (5) so headings have ids.
+        md.treeprocessors.register(PostStatsTreeprocessor(md), 'post_stats', 4)
+
+
+def _count_words(element):
+    # Code blocks aren't prose, so they don't count towards reading time.
+    if element.tag == 'pre':
+        return 0
+    count = len(_strip_placeholders(element.text or '').split())
+    for child in element:
+        count += _count_words(child) + len(_strip_placeholders(child.tail or '').split())
+    return count
+
+def _strip_placeholders(text):
+    return INLINE_PLACEHOLDER_RE.sub('', HTML_PLACEHOLDER_RE.sub('', text))
+
+
+class CachedFencedBlockPreprocessor(FencedBlockPreprocessor):
+    """Stores fenced blocks highlighted by the compiler's cached highlighter."""
+
+    def run(self, lines):
+        text = '\n'.join(lines)
+        match = self.FENCED_BLOCK_RE.search(text)
+        while match:
+            html = self.md.highlight(match.group('code'), match.group('lang') or None,
+                                     parse_hl_lines(match.group('hl_lines')))
+            placeholder = self.md.htmlStash.store(html)
+            text = f'{text[:match.start()]}\n{placeholder}\n{text[match.end():]}'
+            match = self.FENCED_BLOCK_RE.search(text)
+        return text.split('\n')
+
+
+class CachedHiliteTreeprocessor(HiliteTreeprocessor):
+    """Highlights indented code blocks with the compiler's cached highlighter."""
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                html = self.md.highlight(self.code_unescape(block[0].text), None, [])
+                block.clear()
+                block.tag = 'p'
+                block.text = self.md.htmlStash.store(html)
+
+
+class HighlightExtension(Extension):
+    """
+    Replaces the fenced_code and codehilite extensions, routing both kinds
+    of code block through md.highlight.
+    """
+
+    def extendMarkdown(self, md):
+        md.preprocessors.register(CachedFencedBlockPreprocessor(md), 'fenced_code_block', 25)
+        md.treeprocessors.register(CachedHiliteTreeprocessor(md), 'hilite', 30)
+
+
+class PostCompiler(object):
+    """
+    Renders a post's markdown and derives everything saved alongside it
+    in a single pass. Building the Markdown instance and its extensions is
+    the expensive part, so one is kept and reset between posts.
+    """
+
+    highlight_options = {
+        'linenums': False,
+        'guess_lang': True,
+        'css_class': 'highlight',
+        'style': 'default',
+        'noclasses': False,
+        'use_pygments': True
+    }
+
+    def __init__(self):
+        self.md = Markdown(extensions=[HighlightExtension(), 'toc', PostStatsExtension()])
+        self.md.highlight = self.highlight
+        self.highlight_cache = None
+
+    def highlight(self, code, lang, hl_lines):
+        """
+        Pygments is by far the slowest part of rendering a post, so the html
+        of each code block is cached by its language, options and content.
+        """
+
+        key = repr((lang, hl_lines, self.md.tab_length, sorted(self.highlight_options.items())))
+        key = hashlib.sha256((key + '\0' + code).encode('utf-8')).hexdigest()
+
+        cache = self.highlight_cache
+        if cache is not None:
+            html = cache.get(key)
+            cache.record(html is not None)
+            if html is not None:
+                return html
+
+        html = CodeHilite(code, lang=lang, hl_lines=hl_lines, tab_length=self.md.tab_length,
+                          **self.highlight_options).hilite()
+        if cache is not None:
+            cache.set(key, html)
+        return html
+
+    def compile(self, title, markdown_text, highlight_cache=None):
+        self.highlight_cache = highlight_cache
+        self.md.reset()
+        html = self.md.convert(markdown_text)
+        toc = self.md.toc if self.md.toc_tokens else None
+        return CompiledPost(slugify(title), html, self.md.post_summary, self.md.post_word_count, toc)
+
+
+def slugify(title):
+    return re.sub('[^\\w]+', '-', title.lower())
+
+# Markdown instances aren't thread safe, so each thread gets its own.
+_compilers = local()
+
+def get_compiler():
+    compiler = getattr(_compilers, 'compiler', None)
+    if compiler is None:
+        compiler = _compilers.compiler = PostCompiler()
+    return compiler
+
+def highlight_cache():
+    return current_app.extensions.get('highlight_cache')
+
+def init_app(app):
+    app.extensions['highlight_cache'] = make_cache(app.config['HIGHLIGHT_CACHE_TYPE'],
+                                                   app.config['HIGHLIGHT_CACHE_MAX_BYTES'],
+                                                   app.config['HIGHLIGHT_CACHE_DIR'])
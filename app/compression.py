@@ -0,0 +1,116 @@
+from flask import current_app, request, g
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def init_app(app):
+    """
+    Compresses text responses with brotli or gzip, whichever the client
+    prefers. Must be set up before conditional so its hook runs after the
+    validators are added. Pages from the page cache keep their compressed
+    bytes in it too.
+
+    Pages that render a CSRF token, and responses to forms, are left
+    uncompressed: the token next to reflected input (a search, a form
+    being redisplayed) could otherwise be recovered by BREACH.
+    """
+
+    if not app.config['COMPRESS_ENABLED']:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+            return response
+        response.vary.add('Accept-Encoding')
+
+        if (response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers or request.method != 'GET'):
+            return response
+
+        # Flask-WTF keeps the token it rendered into the page in g.
+        if app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g:
+            return response
+
+        encoding = choose_encoding(encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = _cached_or_compressed(response, encoding)
+            if data is None:
+                return response
+            response.set_data(data)
+
+        response.content_encoding = encoding
+        # Each encoding is a different representation, so its validator
+        # has to be weak. If-None-Match still matches it.
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def choose_encoding(available):
+    """The encoding of available the client accepts most, or None."""
+    encoding = request.accept_encodings.best_match(available)
+    if encoding is None or request.accept_encodings[encoding] == 0:
+        return None
+    return encoding
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, current_app.config['COMPRESS_GZIP_LEVEL'])
+
+def _cached_or_compressed(response, encoding):
+    # Set by views whose page came from (or went into) the page cache.
+    cached = g.get('page_cache')
+    if cached is not None:
+        from app import page_cache
+        name, version = cached
+        data = page_cache.get(name, version, encoding)
+        if data is not None:
+            return data
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return None
+    data = compress(data, encoding)
+
+    if cached is not None:
+        page_cache.set(name, version, data, encoding)
+    return data
+
+def _compress_stream(chunks, encoding):
+    # The compressor is made here, while there's still an app context.
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+        return _stream(chunks, compressor.process, compressor.flush, compressor.finish)
+
+    compressor = zlib.compressobj(current_app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _stream(chunks, compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush)
+
+def _stream(chunks, process, flush, finish):
+    # Every chunk is flushed so streamed pages still arrive as they're made.
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
@@ -0,0 +1,60 @@
+from flask import current_app, request, session, g
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from app.cache import render_generation
+import hashlib
+
+def not_modified(last_modified, *parts):
+    """
+    Builds the page's validators from everything it shows (parts) and the
+    newest date_edited behind it. Returns a 304 response when the client
+    already has this version; otherwise the validators are added to the
+    response by the after_request hook.
+
+    Only the ETag decides: the date doesn't change when an author renames
+    themselves or the visitor logs in, so If-Modified-Since is ignored and
+    Last-Modified is just informational.
+    """
+
+    if session.get('_flashes'):
+        return None
+
+    key = repr((current_app.config['ETAG_VERSION'], render_generation(), current_user.get_id(), parts))
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    g.validators = (etag, last_modified)
+
+    if is_resource_modified(request.environ, etag=etag):
+        return None
+
+    response = current_app.response_class(status=304)
+    _add_validators(response)
+    return response
+
+def listing_validators(pagination):
+    """
+    The validators of a page of posts: what _post.html shows for each one
+    plus the links to the neighbouring pages.
+    """
+
+    parts = [(post.id, post.date_edited, post.author.username, post.author.name)
+             for post in pagination.items]
+    parts.append((pagination.prev_url, pagination.next_url, pagination.pages))
+    last_modified = max((post.date_edited for post in pagination.items), default=None)
+    return last_modified, parts
+
+def _add_validators(response):
+    etag, last_modified = g.validators
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.vary.add('Cookie')
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+
+def init_app(app):
+    @app.after_request
+    def add_validators(response):
+        if 'validators' in g and response.status_code == 200:
+            _add_validators(response)
+        return response
@@ -1,5 +1,5 @@
 from flask_mail import Message
-from app import mail
+from app import mail_queue
 from time import time
 import jwt
 
@@ -7,4 +7,4 @@ def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    mail.send(msg)
\ No newline at end of file
+    mail_queue.send(msg)
\ No newline at end of file
@@ -0,0 +1,73 @@
+from flask import current_app, render_template, request, url_for, g
+from werkzeug.http import http_date
+from app import page_cache
+from app.conditional import not_modified
+from app.models import Post, User
+import json
+
+MIMETYPES = {
+    'rss': 'application/rss+xml',
+    'atom': 'application/atom+xml',
+    'json': 'application/feed+json'
+}
+
+def feed_response(kind, name, title, link, query):
+    """
+    Serves the newest FEED_LENGTH posts of query as an RSS, Atom or JSON
+    feed. The feed is versioned by the ids, edit dates and authors of the
+    posts in it, read with one small select, so polls of an unchanged feed
+    get a 304 or the copy in the page cache without loading any posts.
+    """
+
+    rows = query.outerjoin(Post.author) \
+                .with_entities(Post.id, Post.date_edited, User.username, User.name) \
+                .order_by(Post.date_published.desc(), Post.id.desc()) \
+                .limit(current_app.config['FEED_LENGTH']) \
+                .all()
+    version = tuple(tuple(row) for row in rows)
+    last_modified = max((row.date_edited for row in rows), default=None)
+
+    response = not_modified(last_modified, 'feed', kind, name, version)
+    if response:
+        return response
+
+    # Lets the compression hook keep its output in the page cache too. The
+    # feed's links are absolute, so each host it's served under has a copy.
+    g.page_cache = (f'feed/{request.host_url}{name}.{kind}', version)
+    feed = page_cache.get(*g.page_cache)
+    if feed is None:
+        ids = [row.id for row in rows]
+        posts = dict((post.id, post) for post in Post.query.listing(tags=True).filter(Post.id.in_(ids))) if ids else {}
+        feed = _render(kind, title, link, [posts[id] for id in ids if id in posts], last_modified)
+        page_cache.set(*g.page_cache, feed)
+
+    return current_app.response_class(feed, mimetype=MIMETYPES[kind])
+
+def _render(kind, title, link, posts, updated):
+    if kind != 'json':
+        return render_template(f'feeds/{kind}.xml', title=title, link=link, posts=posts, updated=updated,
+                               http_date=http_date, rfc3339=_rfc3339)
+
+    return json.dumps({
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': title,
+        'home_page_url': link,
+        'feed_url': request.base_url,
+        'items': [{
+            'id': url_for('main.blog', slug=post.slug, _external=True),
+            'url': url_for('main.blog', slug=post.slug, _external=True),
+            'title': post.title,
+            'summary': post.summary,
+            'content_text': post.summary,
+            'date_published': _rfc3339(post.date_published),
+            'date_modified': _rfc3339(post.date_edited),
+            'authors': [{
+                'name': post.author.name or post.author.username,
+                'url': url_for('main.member', username=post.author.username, _external=True)
+            }] if post.author else [],
+            'tags': [tag.title for tag in post.tags]
+        } for post in posts]
+    })
+
+def _rfc3339(date):
+    return date.replace(microsecond=0).isoformat() + 'Z' if date != None else None
@@ -0,0 +1,251 @@
+from flask import current_app, has_app_context, template_rendered, url_for
+from flask.cli import with_appcontext
+from threading import Condition, Lock, Thread, get_ident
+from urllib import parse
+import click
+import json
+import os
+import time
+
+class Freezer(object):
+    """
+    Renders the public pages (the home page, posts, members and the about
+    page) to a directory that nginx can serve while the app only handles
+    the rest. Searches aren't frozen since their form carries a CSRF token.
+    The pages are what anonymous visitors see, so requests with a session
+    or remember cookie (logged in users) skip them and go to the app:
+
+        map "$cookie_session$cookie_remember_token" $frozen {
+            ""      "";
+            default "/not-frozen";
+        }
+
+        location /static/ { alias /path/to/app/static/; }
+        location / {
+            root /path/to/freeze_dir;
+            try_files $frozen$uri/@$args.html $frozen$uri/index.html @app;
+        }
+
+    A page at path/ is written to path/index.html, and with a query string
+    (the next pages of a listing) to path/@query.html, so the links in the
+    pages resolve to files. Listings are followed through their next pages,
+    and the files each one wrote are kept in .freeze.json so the pages it
+    no longer has are removed when it's rebuilt.
+
+    With FREEZE_INCREMENTAL, each commit that changes posts rebuilds just
+    the pages that show them, from a background thread. Changes to users'
+    profiles only show up after a full freeze.
+    """
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self._manifest_lock = Lock()
+        self._condition = Condition()
+        self._changes = []
+        self._busy = False
+        self._thread = None
+
+    def freeze_all(self):
+        from app import db
+        from app.models import Post, User
+
+        with self.app.app_context():
+            slugs = [row.slug for row in db.session.query(Post.slug)]
+            usernames = [row.username for row in db.session.query(User.username)]
+            db.session.remove()
+
+        with self.app.test_request_context():
+            listings = [url_for('main.index')] + [url_for('main.member', username=username)
+                                                  for username in usernames]
+            count = self.page(url_for('main.about'))
+            for slug in slugs:
+                count += self.page(url_for('main.blog', slug=slug))
+            for url in listings:
+                count += self.listing(url)
+        # Drops the listings that are gone, such as deleted members'.
+        self._prune(listings)
+        return count
+
+    def rebuild(self, changes):
+        """
+        Rebuilds the pages that show the posts in changes: their own pages,
+        the home page, and their authors' listings.
+        """
+
+        from app import db
+        from app.models import User
+
+        with self.app.app_context():
+            user_ids = set(change.user_id for change in changes if change.user_id != None)
+            usernames = [row.username for row in
+                         db.session.query(User.username).filter(User.id.in_(user_ids))] if user_ids else []
+            db.session.remove()
+
+        with self.app.test_request_context():
+            count = 0
+            for change in changes:
+                for slug in change.old_slugs + ([change.slug] if change.deleted else []):
+                    self._remove(self._path(url_for('main.blog', slug=slug)))
+                if not change.deleted:
+                    count += self.page(url_for('main.blog', slug=change.slug))
+
+            count += self.listing(url_for('main.index'))
+            for username in usernames:
+                count += self.listing(url_for('main.member', username=username))
+        return count
+
+    def page(self, url):
+        response, _ = self._render(url)
+        if response.status_code != 200:
+            self._remove(self._path(url))
+            return 0
+        self._write(self._path(url), response.get_data())
+        return 1
+
+    def listing(self, url):
+        """Freezes a listing and its next pages, removing any it no longer has."""
+
+        files = []
+        next_url = url
+        while next_url is not None:
+            response, following = self._render(next_url)
+            if response.status_code != 200:
+                break
+            files.append(self._path(next_url))
+            self._write(files[-1], response.get_data())
+            next_url = following
+
+        with self._manifest_lock:
+            manifest = self._read_manifest()
+            for name in set(manifest.get(url, [])) - set(files):
+                self._remove(name)
+            manifest[url] = files
+            self._write_manifest(manifest)
+        return len(files)
+
+    def _prune(self, listings):
+        with self._manifest_lock:
+            manifest = self._read_manifest()
+            for url in set(manifest) - set(listings):
+                for name in manifest.pop(url):
+                    self._remove(name)
+            self._write_manifest(manifest)
+
+    def queue(self, changes):
+        """Rebuilds the pages of changes in the background."""
+
+        with self._condition:
+            self._changes += changes
+            self._condition.notify_all()
+            # Started on first use so forked workers each get a thread.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name='freezer', daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=None):
+        """
+        Waits until the queued changes have been rebuilt. Returns False if
+        the timeout ran out first.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._changes or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._changes:
+                    self._condition.wait()
+                # Everything committed while the last rebuild ran is done at once.
+                changes, self._changes = self._changes, []
+                self._busy = True
+
+            try:
+                self.rebuild(changes)
+            except Exception:
+                self.app.logger.exception('Rebuilding the frozen pages failed')
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _render(self, url):
+        # A listing's next page is read off the context of its template,
+        # ignoring the requests other threads are serving meanwhile.
+        next_urls = []
+        thread = get_ident()
+        def record(sender, template, context, **extra):
+            if get_ident() == thread:
+                next_urls.append(context.get('next_url'))
+
+        with template_rendered.connected_to(record, self.app):
+            response = self.app.test_client().get(url)
+        return response, next_urls[0] if next_urls else None
+
+    def _path(self, url):
+        parts = parse.urlsplit(url)
+        segments = [segment for segment in parse.unquote(parts.path).split('/') if segment]
+        if any(segment in ('.', '..') for segment in segments):
+            raise ValueError(f'Can\'t freeze {url}')
+        return '/'.join(segments + [f'@{parts.query}.html' if parts.query else 'index.html'])
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, '.freeze.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_manifest(self, manifest):
+        self._write('.freeze.json', json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def init_app(app):
+    app.cli.add_command(freeze_command)
+
+    if app.config['FREEZE_DIR'] and app.config['FREEZE_INCREMENTAL']:
+        app.extensions['freezer'] = Freezer(app, app.config['FREEZE_DIR'])
+
+        from app.models import posts_committed
+        posts_committed.connect(_queue_changes, weak=False)
+
+def _queue_changes(sender, changes):
+    freezer = current_app.extensions.get('freezer') if has_app_context() else None
+    if freezer is not None:
+        freezer.queue(changes)
+
+
+@click.command('freeze')
+@click.option('--output', '-o', type=click.Path(file_okay=False),
+              help='Directory to write the pages to. Defaults to freeze_dir from config.json.')
+@with_appcontext
+def freeze_command(output):
+    """Render every public page to static files."""
+
+    output = output or current_app.config['FREEZE_DIR']
+    if not output:
+        raise click.UsageError('Give --output or set freeze_dir in config.json.')
+
+    started = time.perf_counter()
+    count = Freezer(current_app._get_current_object(), output).freeze_all()
+    print(f'Froze {count} pages to {output} in {time.perf_counter() - started:.1f}s.')
@@ -0,0 +1,180 @@
+from flask_mail import Message
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue
+from threading import Thread, Event, Lock
+import atexit
+import logging
+import os
+import time
+
+class PreparingQueueHandler(QueueHandler):
+    """
+    Queues records for a listener thread that passes them to targets.
+    Records are formatted before they're queued, which flattens the
+    exception into text, so the error's signature is worked out first.
+
+    The listener is started by the first record each process logs, so
+    servers that fork workers after creating the app get one per worker
+    instead of queues that nothing reads.
+    """
+
+    def __init__(self, *targets):
+        super().__init__(None)
+        self.targets = targets
+        self._listener = None
+        self._pid = None
+        self._start_lock = Lock()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().enqueue(record)
+
+    def prepare(self, record):
+        record.signature = _signature(record)
+        return super().prepare(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # The queue is replaced too, since a forked one's lock may be held.
+            self.queue = Queue()
+            self._listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._stop)
+
+    def _stop(self):
+        if self._pid == os.getpid():
+            self._listener.stop()
+            for target in self.targets:
+                target.close()
+
+def _signature(record):
+    if record.exc_info and record.exc_info[1] is not None:
+        tb = record.exc_info[2]
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        where = (tb.tb_frame.f_code.co_filename, tb.tb_lineno) if tb is not None else None
+        return (record.exc_info[0].__name__, where)
+    return (record.pathname, record.lineno, str(record.msg))
+
+
+class DigestMailHandler(logging.Handler):
+    """
+    Collects error records and mails the admins a digest of them at most
+    once every interval seconds, with repeats of the same error counted
+    instead of listed. The first error after a quiet interval is sent
+    straight away. The mail queue's own errors are left out, since they
+    would be sent through the queue that's failing.
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(logging.ERROR)
+        self.app = app
+        self.interval = interval
+        self._errors = {}
+        self._last_sent = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._pid = None
+        mail_queue_logger = app.logger.getChild('mail_queue').name
+        self.addFilter(lambda record: record.name != mail_queue_logger)
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        signature = getattr(record, 'signature', None) or _signature(record)
+        with self._lock:
+            error = self._errors.get(signature)
+            if error is None:
+                self._errors[signature] = [1, record.created, record.created, self.format(record)]
+            else:
+                error[0] += 1
+                error[2] = record.created
+            quiet = time.time() - self._last_sent >= self.interval
+        if quiet:
+            self.send_digest()
+
+    def send_digest(self):
+        with self._lock:
+            errors, self._errors = self._errors, {}
+            if errors:
+                self._last_sent = time.time()
+        if not errors:
+            return
+
+        total = sum(error[0] for error in errors.values())
+        sections = []
+        for count, first, last, text in sorted(errors.values(), key=lambda e: e[1]):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(first))
+            if count > 1:
+                when += f' to {time.strftime("%H:%M:%S", time.gmtime(last))}, {count} times'
+            sections.append(f'{when}\n{text}')
+
+        config = self.app.config
+        message = Message(f'Precisamento Failure ({total} errors)' if total > 1 else 'Precisamento Failure',
+                          sender='no-reply@' + config['MAIL_SERVER'],
+                          recipients=config['ADMINS'])
+        message.body = ('\n\n' + '-' * 70 + '\n\n').join(sections)
+        try:
+            with self.app.app_context():
+                self.app.extensions['mail_queue'].send(message)
+        except Exception:
+            self.handleError(None)
+
+    def _start(self):
+        # Started on first use, like the queue listener, so each worker has one.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = Thread(target=self._run, name='log-digest', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.send_digest()
+
+    def close(self):
+        self._stop.set()
+        self.send_digest()
+        super().close()
+
+
+def init_app(app):
+    """
+    Sends app.logger's records through a queue to a listener thread, which
+    writes them to logs/blog.log and mails error digests to the admins, so
+    logging never waits on the disk or an SMTP server.
+    """
+
+    handlers = []
+
+    if app.config['MAIL_SERVER']:
+        digest_handler = DigestMailHandler(app, app.config['LOG_DIGEST_INTERVAL'])
+        digest_handler.setFormatter(logging.Formatter(
+            '%(levelname)s in %(module)s [%(pathname)s:%(lineno)d]:\n%(message)s'))
+        handlers.append(digest_handler)
+
+    if not os.path.exists('logs'):
+        os.mkdir('logs')
+
+    file_handler = RotatingFileHandler('logs/blog.log', maxBytes=app.config['LOG_MAX_BYTES'],
+                                       backupCount=app.config['LOG_BACKUP_COUNT'])
+    file_handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s [in %(pathname)s:%(lineno)d'))
+    file_handler.setLevel(logging.INFO)
+    handlers.append(file_handler)
+
+    app.logger.addHandler(queue_handler(*handlers))
+    app.logger.setLevel(logging.INFO)
+
+def queue_handler(*handlers):
+    """
+    Returns a handler that queues records for a listener thread to pass
+    to handlers, which are closed when the process exits.
+    """
+
+    return PreparingQueueHandler(*handlers)
@@ -0,0 +1,209 @@
+from queue import Queue, Empty
+from smtplib import SMTPException, SMTPRecipientsRefused
+from threading import Thread, Lock
+import heapq
+import os
+import pickle
+import time
+import uuid
+
+class MailQueue(object):
+    """
+    Sends mail from a background thread so a slow or unreachable SMTP
+    server never holds up a request.
+
+    Each message is spooled to MAIL_SPOOL_DIR before it's queued and only
+    removed once sent, so messages outlive a restart. Queued messages are
+    sent over one SMTP connection, which is kept open for MAIL_IDLE_TIMEOUT
+    seconds after the queue empties. Failed sends are retried with an
+    exponential backoff starting at MAIL_RETRY_DELAY seconds, and after
+    MAIL_MAX_RETRIES the message is moved to the spool's failed directory.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = Queue()
+        self._retries = []
+        self._pending = 0
+        self._thread = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # A child of app.logger that the error digest leaves out.
+        self.logger = app.logger.getChild('mail_queue')
+        app.extensions['mail_queue'] = self
+        if app.config['MAIL_QUEUE']:
+            os.makedirs(os.path.join(app.config['MAIL_SPOOL_DIR'], 'failed'), exist_ok=True)
+
+    def send(self, message):
+        if not self.app.config['MAIL_QUEUE']:
+            self.app.extensions['mail'].send(message)
+            return
+
+        # Spooled under this process's id so no other process picks it up.
+        path = self._spool_path(f'{time.time_ns()}-{uuid.uuid4().hex}')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(message, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+        self._start()
+        self._put(path, 0)
+
+    def flush(self, timeout=None):
+        """
+        Waits until everything queued has been sent or given up on.
+        Returns False if the timeout ran out first.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _spool_path(self, name):
+        return os.path.join(self.app.config['MAIL_SPOOL_DIR'], f'{name}.{_owner()}.msg')
+
+    def _put(self, path, attempts):
+        with self._lock:
+            self._pending += 1
+        self._queue.put((path, attempts))
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _start(self):
+        # Started on first use rather than in init_app so that servers which
+        # fork workers after creating the app get a thread in each worker.
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name='mail-queue', daemon=True)
+            self._thread.start()
+            orphans = self._claim_orphans()
+        for path in orphans:
+            self._put(path, 0)
+
+    def _claim_orphans(self):
+        """
+        Takes over the messages spooled by processes that are no longer
+        running, such as this one's previous run, by renaming them.
+        """
+
+        spool = self.app.config['MAIL_SPOOL_DIR']
+        claimed = []
+        for name in sorted(os.listdir(spool)):
+            if not name.endswith('.msg'):
+                continue
+            base, owner, _ = name.rsplit('.', 2)
+            # A live pid is left to its process, which knows whether the
+            # files are its own or from an earlier process with its pid.
+            pid = int(owner.partition('-')[0])
+            if owner == _owner() or (pid != os.getpid() and _process_alive(pid)):
+                continue
+            path = self._spool_path(base)
+            try:
+                os.rename(os.path.join(spool, name), path)
+            except OSError:
+                continue
+            claimed.append(path)
+        return claimed
+
+    def _run(self):
+        with self.app.app_context():
+            mail = self.app.extensions['mail']
+            connection = None
+            while True:
+                try:
+                    path, attempts = self._queue.get(timeout=self._wait_time(connection))
+                except Empty:
+                    self._requeue_due()
+                    if connection is not None and self._queue.empty():
+                        _close(connection)
+                        connection = None
+                    continue
+
+                try:
+                    with open(path, 'rb') as f:
+                        message = pickle.load(f)
+
+                    if connection is None:
+                        connection = mail.connect().__enter__()
+                    connection.send(message)
+                    os.remove(path)
+                    self._done()
+                except FileNotFoundError:
+                    self._done()
+                except SMTPRecipientsRefused as e:
+                    self._fail(path, e)
+                except (SMTPException, OSError) as e:
+                    if connection is not None:
+                        _close(connection)
+                        connection = None
+                    self._retry(path, attempts, e)
+                except Exception as e:
+                    self._fail(path, e)
+
+                self._requeue_due()
+
+    def _wait_time(self, connection):
+        waits = [self.app.config['MAIL_IDLE_TIMEOUT']] if connection is not None else []
+        if self._retries:
+            waits.append(max(0, self._retries[0][0] - time.monotonic()))
+        return min(waits) if waits else None
+
+    def _retry(self, path, attempts, error):
+        attempts += 1
+        if attempts > self.app.config['MAIL_MAX_RETRIES']:
+            self._fail(path, error)
+            return
+        delay = self.app.config['MAIL_RETRY_DELAY'] * 2 ** (attempts - 1)
+        self.logger.warning(f'Sending mail failed ({error}), retrying in {delay}s')
+        heapq.heappush(self._retries, (time.monotonic() + delay, path, attempts))
+
+    def _requeue_due(self):
+        while self._retries and self._retries[0][0] <= time.monotonic():
+            _, path, attempts = heapq.heappop(self._retries)
+            self._queue.put((path, attempts))
+
+    def _fail(self, path, error):
+        self.logger.error(f'Giving up sending mail {os.path.basename(path)}: {error}')
+        try:
+            os.replace(path, os.path.join(self.app.config['MAIL_SPOOL_DIR'], 'failed',
+                                          os.path.basename(path)))
+        except OSError:
+            pass
+        self._done()
+
+
+_nonce = None
+_nonce_pid = None
+
+def _owner():
+    # The pid alone isn't enough: a worker restarted in a container often
+    # gets the pid of the one that died, whose spool it must still claim.
+    global _nonce, _nonce_pid
+    if _nonce_pid != os.getpid():
+        _nonce = uuid.uuid4().hex[:12]
+        _nonce_pid = os.getpid()
+    return f'{_nonce_pid}-{_nonce}'
+
+def _close(connection):
+    try:
+        connection.__exit__(None, None, None)
+    except (SMTPException, OSError):
+        pass
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
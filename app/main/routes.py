@@ -1,26 +1,28 @@
-from flask import render_template, flash, redirect, url_for, request, current_app, Markup
+from flask import render_template, flash, redirect, url_for, request, Markup, session, g, abort
 from flask_login import current_user
-from app import db
+from app import db, page_cache, search_cache
 from app.main import bp
 from app.main.forms import SearchForm
 from app.models import Post, Tag, User
-from sqlalchemy import func
+from app.pagination import paginate_posts, paginate_ids
+from app.conditional import not_modified, listing_validators
+from app.feeds import feed_response
 from urllib import parse
 
 @bp.route('/')
 def index():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_published.desc()).paginate(page, current_app.config['POSTS_PER_PAGE'], True)
+    posts = paginate_posts(Post.query.listing(), [Post.date_published, Post.id], 'main.index')
 
-    next_url = url_for('main.index', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) if posts.has_prev else None
+    response = not_modified(*listing_validators(posts))
+    if response:
+        return response
 
     return render_template('blogs.html', 
                             title='Home', 
-                            page=page, 
+                            page=posts.page, 
                             posts=posts.items,
-                            next_url=next_url,
-                            prev_url=prev_url,
+                            next_url=posts.next_url,
+                            prev_url=posts.prev_url,
                             pagination=posts)
 
 @bp.route('/about')
@@ -31,30 +33,81 @@ def about():
 
 @bp.route('/blog/<slug>')
 def blog(slug):
-    post = Post.query.filter_by(slug=slug).first_or_404()
+    # Logged in users get the edit button and nav links, so only
+    # anonymous pages without pending flashes are shared.
+    cacheable = not current_user.is_authenticated and not session.get('_flashes')
+    version = db.session.query(Post.date_edited, User.username, User.name) \
+                        .outerjoin(Post.author) \
+                        .filter(Post.slug == slug) \
+                        .first_or_404()
+
+    response = not_modified(version.date_edited, slug, tuple(version))
+    if response:
+        return response
+
+    if cacheable:
+        # Lets the compression hook keep its output in the page cache too.
+        g.page_cache = (f'blog/{slug}', tuple(version))
+        page = page_cache.get(f'blog/{slug}', tuple(version))
+        if page is not None:
+            return page
+
+    post = Post.query.listing(tags=True).with_body().filter_by(slug=slug).first_or_404()
     body = Markup(post.html_body)
-    return render_template('blog.html', title=post.title, post=post, body=body)
+    page = render_template('blog.html', title=post.title, post=post, body=body)
+
+    if cacheable:
+        page_cache.set(f'blog/{slug}', tuple(version), page)
+    return page
 
 @bp.route('/member/<username>')
 def member(username):
     member = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_published.desc()) \
-                      .filter_by(user_id=member.id) \
-                      .paginate(page, current_app.config['POSTS_PER_PAGE'], True)
+    posts = paginate_posts(Post.query.listing().filter_by(user_id=member.id),
+                           [Post.date_published, Post.id],
+                           'main.member', username=username)
 
-    next_url = url_for('main.member', username=username, page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.member', username=username, page=posts.prev_num) if posts.has_prev else None
+    last_modified, parts = listing_validators(posts)
+    parts.append((member.username, member.name, member.about_me, member.avatar_hash))
+    response = not_modified(last_modified, parts)
+    if response:
+        return response
 
     return render_template('member_profile.html',
                            title=member.name if member.name else username,
                            member=member,
-                           page=page,
+                           page=posts.page,
                            posts=posts.items,
-                           next_url=next_url,
-                           prev_url=prev_url,
+                           next_url=posts.next_url,
+                           prev_url=posts.prev_url,
                            pagination=posts)
 
+@bp.route('/feed.xml', defaults={ 'kind': 'rss' })
+@bp.route('/atom.xml', defaults={ 'kind': 'atom' })
+@bp.route('/feed.json', defaults={ 'kind': 'json' })
+def feed(kind):
+    return feed_response(kind, 'all', 'SimplyPrecise', url_for('main.index', _external=True), Post.query)
+
+@bp.route('/member/<username>/feed.xml', defaults={ 'kind': 'rss' })
+@bp.route('/member/<username>/atom.xml', defaults={ 'kind': 'atom' })
+@bp.route('/member/<username>/feed.json', defaults={ 'kind': 'json' })
+def member_feed(username, kind):
+    member = User.query.filter_by(username=username).first_or_404()
+    return feed_response(kind, f'member/{member.id}', f'{member.name or member.username} | SimplyPrecise',
+                         url_for('main.member', username=username, _external=True),
+                         Post.query.filter_by(user_id=member.id))
+
+@bp.route('/tag/<tag>/feed.xml', defaults={ 'kind': 'rss' })
+@bp.route('/tag/<tag>/atom.xml', defaults={ 'kind': 'atom' })
+@bp.route('/tag/<tag>/feed.json', defaults={ 'kind': 'json' })
+def tag_feed(tag, kind):
+    tag_ids = Tag.get_valid([tag])
+    if len(tag_ids) == 0:
+        abort(404)
+    return feed_response(kind, f'tag/{tag_ids[0]}', f'{tag} | SimplyPrecise',
+                         url_for('main.search', t=tag, _external=True),
+                         Post.query.tagged(tag_ids))
+
 @bp.route('/searchbar', methods=['POST'])
 def searchbar():
     if request.form.get('search', '') != '':
@@ -73,53 +126,62 @@ def search():
     else:
         query = parse.unquote_plus(request.args.get('q', ''))
         tags = parse.unquote_plus(request.args.get('t', ''))
+        tag_all = request.args.get('all', 0, type=int) == 1
         form.query.data = query
         form.tags.data = tags
-        tag_all = False
+        form.tags_inclusive.data = 'All' if tag_all else 'Any'
 
     if not query and not tags:
         return render_template('new_search.html', title='Search', form=form)
-    else:
-        items = None
-        if query:
-            items = Post.query.search(query, sort=True)
+
+    url_values = { 'q': query or None, 't': tags or None, 'all': 1 if tag_all else None }
+    tags = set(filter(None, tags.split(' ')))
+    key = search_cache.key(query, tags, tag_all)
+    ids = search_cache.get(key)
+
+    if ids is None:
+        items, keys = _search_query(query, tags, tag_all)
+        if items is None:
+            ids = []
+        elif search_cache.backend is None:
+            posts = paginate_posts(items.listing(), keys, 'main.search', page_arg='p', **url_values)
         else:
-            items = Post.query
-
-        if tags:
-            tags = list(filter(None, tags.split(' ')))
-            old_len = len(tags)
-            tags = Tag.get_valid(tags)
-            new_len = len(tags)
-
-            if (new_len == 0 and query == '') or (tag_all and old_len != new_len):
-                items = None
-            else:
-                items = items.join(Post.tags) \
-                             .filter(Tag.id.in_(map(lambda t: t.id, tags)))
-    
-                if tag_all:
-                    items = items.group_by(Post.id) \
-                                 .having(func.count(Tag.id) == len(tags))
-
-
-    if items == None:
-        return render_template('no_search_results.html', title='Search', form=form)
+            ids = [row.id for row in items.with_entities(Post.id)
+                                          .order_by(*[key.desc() for key in keys])]
+            search_cache.set(key, ids)
 
-    page = request.args.get('p', 1, type=int)
-    posts = items.paginate(page, current_app.config['POSTS_PER_PAGE'], True)
+    if ids is not None:
+        posts = paginate_ids(Post.query.listing(), Post.id, ids, 'main.search', page_arg='p', **url_values)
 
     if len(posts.items) == 0:
         return render_template('no_search_results.html', title='Search', form=form)
 
-    next_url = url_for('main.search', p=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.search', p=posts.prev_num) if posts.has_prev else None
-
     return render_template('search.html', 
                            title='Search',
                            form=form,
-                           page = page,
+                           page = posts.page,
                            posts=posts.items,
-                           next_url=next_url,
-                           prev_url=prev_url,
-                           pagination=posts)
\ No newline at end of file
+                           next_url=posts.next_url,
+                           prev_url=posts.prev_url,
+                           pagination=posts)
+
+def _search_query(query, tags, tag_all):
+    """
+    Returns the search's unordered query and the keys to order it by,
+    or None for the query when nothing can match.
+    """
+
+    if query:
+        items = Post.query.search(query)
+        keys = [Post.search_rank(query), Post.id]
+    else:
+        items = Post.query
+        keys = [Post.date_published, Post.id]
+
+    if tags:
+        tag_ids = Tag.get_valid(tags)
+        if (len(tag_ids) == 0 and query == '') or (tag_all and len(tags) != len(tag_ids)):
+            return None, keys
+        items = items.tagged(tag_ids, match_all=tag_all)
+
+    return items, keys
\ No newline at end of file
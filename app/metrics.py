@@ -0,0 +1,177 @@
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from threading import Lock
+import time
+
+# Seconds; the same default buckets as the Prometheus client libraries.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+class Histogram(object):
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value, *labels):
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with _lock:
+            series = sorted((labels, list(counts), count, total)
+                            for labels, (counts, count, total) in self._series.items())
+        for labels, counts, count, total in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le=bound)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le="+Inf")} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {count}')
+        return lines
+
+
+class Counter(object):
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, *labels):
+        with _lock:
+            self._series[labels] = self._series.get(labels, 0) + 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with _lock:
+            series = sorted(self._series.items())
+        lines += [f'{self.name}{_labels(self.labels, labels)} {value}' for labels, value in series]
+        return lines
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def _gauge(name, help, values):
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    return lines + [f'{name}{_labels(names, labels)} {value}' for names, labels, value in values]
+
+
+_lock = Lock()
+
+requests_total = Counter('blog_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+request_seconds = Histogram('blog_request_duration_seconds', 'Time spent handling a request.',
+                            ('endpoint', 'method'))
+request_queries = Histogram('blog_request_queries', 'SQL statements executed per request.',
+                            ('endpoint',), QUERY_BUCKETS)
+query_seconds = Histogram('blog_query_duration_seconds', 'Time spent executing SQL statements.',
+                          ('endpoint',))
+template_seconds = Histogram('blog_template_render_seconds', 'Time spent rendering templates.',
+                             ('template',))
+
+
+def init_app(app):
+    """
+    Records request latency, SQL statements and template render times per
+    endpoint, for expose() to report in the Prometheus text format. The
+    numbers are per process, so each worker is scraped separately.
+    """
+
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(error):
+        start = g.get('metrics_start')
+        if start is None:
+            return
+        endpoint = request.endpoint or 'none'
+        requests_total.inc(endpoint, request.method, g.get('metrics_status', 500))
+        request_seconds.observe(time.perf_counter() - start, endpoint, request.method)
+        request_queries.observe(g.metrics_queries, endpoint)
+
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_record_template, app)
+
+    if not event.contains(Engine, 'before_cursor_execute', _start_query):
+        event.listen(Engine, 'before_cursor_execute', _start_query)
+        event.listen(Engine, 'after_cursor_execute', _record_query)
+
+
+def _start_template(sender, template, context, **extra):
+    g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+def _record_template(sender, template, context, **extra):
+    starts = g.get('metrics_templates')
+    if starts:
+        template_seconds.observe(time.perf_counter() - starts.pop(), template.name or 'string')
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        query_seconds.observe(elapsed, request.endpoint or 'none')
+    else:
+        query_seconds.observe(elapsed, 'none')
+
+
+def expose(app, db):
+    lines = []
+    for metric in (requests_total, request_seconds, request_queries, query_seconds, template_seconds):
+        lines += metric.expose()
+
+    pool = db.get_engine(app).pool
+    if hasattr(pool, 'checkedout'):
+        lines += _gauge('blog_db_pool_connections', 'Database connections by state.', [
+            (('state',), ('checked_out',), pool.checkedout()),
+            (('state',), ('checked_in',), pool.checkedin()),
+            (('state',), ('overflow',), pool.overflow())])
+        lines += _gauge('blog_db_pool_size', 'Configured database pool size.', [((), (), pool.size())])
+
+    from app.cache import cache_stats
+    stats = cache_stats(app)
+    for key, kind, help in (('hits', 'counter', 'Cache lookups that were used.'),
+                            ('misses', 'counter', 'Cache lookups that missed or were stale.'),
+                            ('entries', 'gauge', 'Entries held by in-process caches.'),
+                            ('bytes', 'gauge', 'Pickled size of the in-process caches.')):
+        values = [(('cache',), (name,), stat[key]) for name, stat in sorted(stats.items()) if key in stat]
+        if values:
+            name = f'blog_cache_{key}' + ('_total' if kind == 'counter' else '')
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(names, labels)} {value}' for names, labels, value in values]
+
+    return '\n'.join(lines) + '\n'
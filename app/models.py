@@ -1,19 +1,32 @@
-from flask import current_app, Markup, abort
+from flask import current_app, Markup, abort, url_for
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, login
-from markdown import markdown
-from markdown.extensions.codehilite import CodeHiliteExtension
+from app import db, login, user_cache
+from app.search import search_backend
+from app.compiler import get_compiler, highlight_cache, WORDS_PER_MINUTE
 from flask_sqlalchemy import BaseQuery
-from sqlalchemy_searchable import SearchQueryMixin, make_searchable
+from sqlalchemy_searchable import make_searchable
 from sqlalchemy_utils.types import TSVectorType
+from sqlalchemy import event, inspect, select, intersect
+from sqlalchemy.orm import selectinload, deferred, undefer_group, make_transient_to_detached
+from sqlalchemy.dialects import postgresql
 from datetime import datetime
-import re
 from enum import Enum
 from functools import total_ordering
+from blinker import Namespace
 
 make_searchable(db.metadata)
 
+_signals = Namespace()
+
+# Sent after a commit that created, edited or deleted posts, with
+# changes=[PostChange, ...]. Receivers can't use the session's objects
+# since they are expired, so each change carries what caches need.
+posts_committed = _signals.signal('posts-committed')
+
+# Sent after a commit that changed or deleted users, with user_ids=[...].
+users_committed = _signals.signal('users-committed')
+
 @total_ordering
 class UserLevel(Enum):
     normal = 0
@@ -36,6 +49,7 @@ class User(UserMixin, db.Model):
     level = db.Column(db.Enum(UserLevel))
     is_verified = db.Column(db.Boolean)
     has_avatar = db.Column(db.Boolean, default=False)
+    avatar_hash = db.Column(db.String(16))
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -46,53 +60,178 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def avatar_url(self, size, extension='png'):
+        return url_for('static', filename=f'images/avatars/{self.id}/{self.avatar_hash}-{size}.{extension}')
+
+    def avatar_srcset(self, extension):
+        return ', '.join(f'{self.avatar_url(size, extension)} {size}w'
+                         for size in current_app.config['AVATAR_SIZES'])
+
 @login.user_loader
 def load_user(id):
-    user = User.query.get(int(id))
+    """
+    Rebuilds the user from the user cache when possible. Merging without
+    loading makes it part of the request's session without a query. The
+    password hash and email are left out of the cache (which may be on
+    disk), and are loaded from the database if they're ever used.
+    """
+
+    id = int(id)
+    values = user_cache.get(id)
+    if values != None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+    else:
+        user = User.query.get(id)
+        if user != None:
+            user_cache.set(id, dict((attr.key, getattr(user, attr.key))
+                                    for attr in inspect(User).column_attrs
+                                    if attr.key not in ('password_hash', 'email')))
+
     if user != None and user.is_verified:
         return user
     return None
 
 
+# The (tag_id, post_id) index is each tag's sorted posting list;
+# (post_id, tag_id) serves loading a post's tags.
 tag_to_post = db.Table('tags',
     db.Column('post_id', db.Integer, db.ForeignKey('post.id')),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')))
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
+    db.Index('ix_tags_tag_id_post_id', 'tag_id', 'post_id', unique=True),
+    db.Index('ix_tags_post_id_tag_id', 'post_id', 'tag_id'))
 
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(64), index=True)
+    title = db.Column(db.String(64), index=True, unique=True)
 
     @staticmethod
     def validate_tags(tag_string):
-        tags = []
-        for split in tag_string.split(' '):
-            if split == '':
-                continue
-
-            tag = Tag.query.filter_by(title=split).first()
-            if tag == None:
-                tag = Tag(title=split)
-                db.session.add(tag)
-            tags.append(tag)
-        return list(set(tags))
+        """
+        Resolves the tags in tag_string with one select, creating the
+        missing ones with a single insert that skips titles another
+        request created in the meantime.
+        """
+
+        titles = set(filter(None, tag_string.split(' ')))
+        if not titles:
+            return []
+
+        tags = Tag.query.filter(Tag.title.in_(titles)).all()
+        missing = titles - set(tag.title for tag in tags)
+        if missing:
+            # Ids seen from here on wait for the commit, as a rollback would undo them.
+            db.session.info.setdefault('new_tag_ids', {})
+            Tag._insert_ignoring_duplicates(missing)
+            created = Tag.query.filter(Tag.title.in_(missing)).all()
+            _tag_id_cache_update(created)
+            tags += created
+        return tags
 
     @staticmethod
     def get_valid(tags):
-        result = []
-        for tag_title in tags:
-            tag = Tag.query.filter_by(title=tag_title).first()
-            if tag == None:
-                continue
+        """
+        Returns the ids of the tags that exist, from the tag id cache
+        where possible and one select for the rest.
+        """
 
-            result.append(tag)
-        return list(set(result))
+        titles = set(tags)
+        ids = {}
+        for title in titles:
+            id = _cached_tag_id(title)
+            if id != None:
+                ids[title] = id
+        missing = titles - set(ids)
+        if missing:
+            found = Tag.query.filter(Tag.title.in_(missing)).all()
+            _tag_id_cache_update(found)
+            ids.update((tag.title, tag.id) for tag in found)
+        return list(set(ids.values()))
+
+    @staticmethod
+    def _insert_ignoring_duplicates(titles):
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            statement = postgresql.insert(Tag.__table__).on_conflict_do_nothing(index_elements=['title'])
+        elif dialect == 'sqlite':
+            statement = Tag.__table__.insert().prefix_with('OR IGNORE')
+        else:
+            statement = Tag.__table__.insert()
+        db.session.execute(statement, [{ 'title': title } for title in titles])
 
     def __repr__(self):
         return f'<Tag {self.title}>'
 
+# Tag titles never change once created, so ids can be kept per app. Ids
+# read in a transaction that inserted tags are held in the session until
+# it commits, and dropped if it rolls back.
+def _cached_tag_id(title):
+    id = current_app.extensions.setdefault('tag_ids', {}).get(title)
+    return id if id != None else db.session.info.get('new_tag_ids', {}).get(title)
+
+def _tag_id_cache_update(tags):
+    pending = db.session.info.get('new_tag_ids')
+    if pending is not None:
+        pending.update((tag.title, tag.id) for tag in tags)
+    else:
+        _store_tag_ids(dict((tag.title, tag.id) for tag in tags))
+
+def _store_tag_ids(ids):
+    size = current_app.config['TAG_ID_CACHE_SIZE']
+    if not size:
+        return
+    cache = current_app.extensions.setdefault('tag_ids', {})
+    if len(cache) + len(ids) > size:
+        cache.clear()
+    cache.update(ids)
+
+
+class PostQuery(BaseQuery):
+    def search(self, search_query, sort=False):
+        """
+        Filters to posts matching search_query using the app's search
+        backend (Postgres tsvector or SQLite FTS5).
+        """
+
+        query = search_backend().filter(self, search_query)
+        if sort and search_query.strip():
+            query = query.order_by(Post.search_rank(search_query).desc())
+        return query
+
+    def listing(self, tags=False):
+        """
+        Loads the authors (and optionally tags) of the selected posts
+        in one batched select each, instead of lazily per post.
+        """
+
+        query = self.options(selectinload(Post.author))
+        if tags:
+            query = query.options(selectinload(Post.tags))
+        return query
 
-class PostQuery(BaseQuery, SearchQueryMixin):
-    pass
+    def with_body(self):
+        """
+        Post bodies are deferred so listings only load the summary columns;
+        use this when the markdown or html is going to be shown.
+        """
+
+        return self.options(undefer_group('body'))
+
+    def tagged(self, tag_ids, match_all=False):
+        """
+        Filters to posts with all (or any) of the tags. The post ids are
+        read off the tags' posting lists and intersected (or unioned) in a
+        subquery, so neither the tag table nor a GROUP BY is needed.
+        """
+
+        post_id = tag_to_post.c.post_id
+        if match_all and len(tag_ids) > 1:
+            posts = intersect(*[select([post_id]).where(tag_to_post.c.tag_id == tag_id)
+                                for tag_id in tag_ids])
+        else:
+            posts = select([post_id]).where(tag_to_post.c.tag_id.in_(tag_ids))
+        return self.filter(Post.id.in_(posts))
 
 class Post(db.Model):
     query_class = PostQuery
@@ -101,21 +240,99 @@ class Post(db.Model):
     title = db.Column(db.Unicode(255))
     slug = db.Column(db.Text, index=True)
     summary = db.Column(db.UnicodeText)
-    html_body = db.Column(db.UnicodeText)
-    markdown_body = db.Column(db.UnicodeText)
+    html_body = deferred(db.Column(db.UnicodeText), group='body')
+    markdown_body = deferred(db.Column(db.UnicodeText), group='body')
+    toc = deferred(db.Column(db.UnicodeText), group='body')
+    word_count = db.Column(db.Integer)
     date_published = db.Column(db.DateTime, index=True)
     date_edited = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     tags = db.relationship('Tag', secondary=tag_to_post, backref=db.backref('posts', lazy='dynamic'), passive_deletes=True)
-    search_vector = db.Column(TSVectorType('title', 'summary', 'markdown_body', weights={'title': 'A', 'summary': 'B', 'markdown_body': 'C'}))
+    search_vector = deferred(db.Column(TSVectorType('title', 'summary', 'markdown_body', weights={'title': 'A', 'summary': 'B', 'markdown_body': 'C'})), group='search')
 
     def __init__(self, *args, **kwargs):
         super(Post, self).__init__(*args, **kwargs)
         self.date_edited = self.date_published = datetime.utcnow()
 
+    @staticmethod
+    def search_rank(search_query):
+        return search_backend().rank(search_query)
+
+    @property
+    def reading_time(self):
+        return max(1, round((self.word_count or 0) / WORDS_PER_MINUTE))
+
     def prepare_to_save(self):
-        self.slug = re.sub('[^\\w]+', '-', self.title.lower())
+        """
+        Renders the markdown and fills in the slug, word count, table of
+        contents and, when none was given, the summary.
+        """
+
+        compiled = get_compiler().compile(self.title, self.markdown_body, highlight_cache())
+        self.slug = compiled.slug
+        self.html_body = Markup(compiled.html)
+        self.word_count = compiled.word_count
+        self.toc = compiled.toc
+        if not self.summary:
+            self.summary = compiled.summary
+
+class PostChange(object):
+    def __init__(self, post, deleted=False):
+        state = inspect(post)
+        self.id = post.id
+        self.deleted = deleted
+        self.slug = post.slug
+        self.user_id = post.user_id
+        self.old_slugs = [slug for slug in state.attrs.slug.history.deleted or () if slug]
+
+    def __repr__(self):
+        return f'<PostChange {self.id} {self.slug}>'
+
+@event.listens_for(db.session, 'after_flush')
+def _record_post_changes(session, flush_context):
+    changes = session.info.setdefault('post_changes', {})
+    posts = [(post, False) for post in session.new.union(session.dirty)] + \
+            [(post, True) for post in session.deleted]
+
+    for post, deleted in posts:
+        if not isinstance(post, Post):
+            continue
+        change = PostChange(post, deleted)
+        if post.id in changes:
+            change.old_slugs += changes[post.id].old_slugs
+        changes[post.id] = change
+
+@event.listens_for(db.session, 'after_commit')
+def _send_post_changes(session):
+    changes = session.info.pop('post_changes', None)
+    if changes:
+        posts_committed.send(session, changes=list(changes.values()))
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_post_changes(session, previous_transaction):
+    session.info.pop('post_changes', None)
+
+@event.listens_for(db.session, 'after_flush')
+def _record_user_changes(session, flush_context):
+    user_ids = session.info.setdefault('user_changes', set())
+    user_ids.update(user.id for user in session.dirty.union(session.deleted) if isinstance(user, User))
+
+@event.listens_for(db.session, 'after_commit')
+def _send_user_changes(session):
+    user_ids = session.info.pop('user_changes', None)
+    if user_ids:
+        users_committed.send(session, user_ids=list(user_ids))
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_user_changes(session, previous_transaction):
+    session.info.pop('user_changes', None)
+
+@event.listens_for(db.session, 'after_commit')
+def _store_new_tag_ids(session):
+    ids = session.info.pop('new_tag_ids', None)
+    if ids:
+        _store_tag_ids(ids)
 
-        hilite = CodeHiliteExtension(linenums=False, css_class='highlight')
-        markdown_text = markdown(self.markdown_body, extensions=[hilite, 'fenced_code'])
-        self.html_body = Markup(markdown_text)
\ No newline at end of file
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_new_tag_ids(session, previous_transaction):
+    session.info.pop('new_tag_ids', None)
@@ -0,0 +1,134 @@
+from flask import current_app, request, url_for, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy import tuple_
+from datetime import datetime
+from math import ceil
+import base64
+import json
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(values) != len(keys):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(v) if key.type.python_type is datetime else v
+                for key, v in zip(keys, values)]
+    except (ValueError, TypeError, NotImplementedError):
+        abort(404)
+
+
+class KeysetPagination(object):
+    """
+    Cursor based pagination over a query ordered descending by keys.
+
+    The keys must uniquely order the rows (end them with a primary key),
+    so a page can be located with a single indexed range scan instead of
+    an OFFSET. The total is only counted when asked for.
+    """
+
+    def __init__(self, query, keys, per_page, after=None, before=None, page=1, count=False):
+        self.keys = keys
+        self.per_page = per_page
+        self.page = page
+        self.total = query.order_by(None).count() if count else None
+
+        query = query.add_columns(*[key.label(f'_keyset_{i}') for i, key in enumerate(keys)])
+        if before is not None:
+            query = query.filter(tuple_(*keys) > tuple_(*before)) \
+                         .order_by(*[key.asc() for key in keys])
+        else:
+            if after is not None:
+                query = query.filter(tuple_(*keys) < tuple_(*after))
+            query = query.order_by(*[key.desc() for key in keys])
+
+        rows = query.limit(per_page + 1).all()
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        if before is not None:
+            rows.reverse()
+            self.has_prev = more
+            self.has_next = True
+        else:
+            self.has_prev = after is not None
+            self.has_next = more
+
+        self.items = [row[0] for row in rows]
+        self._first = list(rows[0][1:]) if rows else None
+        self._last = list(rows[-1][1:]) if rows else None
+
+    @property
+    def pages(self):
+        if self.total is None or self.per_page == 0:
+            return None
+        return int(ceil(self.total / float(self.per_page)))
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self._last) if self.has_next and self._last else None
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self._first) if self.has_prev and self._first else None
+
+
+def paginate_posts(query, keys, endpoint, page_arg='page', **values):
+    """
+    Paginates a post listing using the mode selected by POSTS_PAGINATION_MODE
+    and attaches next_url/prev_url (and page_url for numbered pages).
+    """
+
+    per_page = current_app.config['POSTS_PER_PAGE']
+    page = request.args.get(page_arg, 1, type=int)
+
+    if current_app.config['POSTS_PAGINATION_MODE'] == 'offset':
+        pagination = query.order_by(*[key.desc() for key in keys]).paginate(page, per_page, True)
+        pagination.page_url = lambda num: url_for(endpoint, **{page_arg: num}, **values)
+        pagination.next_url = pagination.page_url(pagination.next_num) if pagination.has_next else None
+        pagination.prev_url = pagination.page_url(pagination.prev_num) if pagination.has_prev else None
+        return pagination
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    # Without a cursor it's the first page, whatever an old offset link says.
+    pagination = KeysetPagination(query, keys, per_page,
+                                  after=decode_cursor(after, keys) if after else None,
+                                  before=decode_cursor(before, keys) if before and not after else None,
+                                  page=max(page, 1) if after or before else 1,
+                                  count=current_app.config['POSTS_PAGINATION_COUNT'])
+
+    pagination.next_url = url_for(endpoint, after=pagination.next_cursor,
+                                  **{page_arg: pagination.page + 1}, **values) if pagination.next_cursor else None
+
+    if pagination.page <= 2 or not pagination.prev_cursor:
+        pagination.prev_url = url_for(endpoint, **values) if pagination.has_prev else None
+    else:
+        pagination.prev_url = url_for(endpoint, before=pagination.prev_cursor,
+                                      **{page_arg: pagination.page - 1}, **values)
+    return pagination
+
+
+def paginate_ids(query, id_column, ids, endpoint, page_arg='page', **values):
+    """
+    Paginates an already ordered list of ids (e.g. cached search results),
+    loading only the rows on the requested page.
+    """
+
+    per_page = current_app.config['POSTS_PER_PAGE']
+    page = request.args.get(page_arg, 1, type=int)
+    if page < 1:
+        abort(404)
+
+    page_ids = ids[(page - 1) * per_page:page * per_page]
+    rows = dict((getattr(row, id_column.key), row)
+                for row in query.filter(id_column.in_(page_ids)).all()) if page_ids else {}
+
+    pagination = Pagination(None, page, per_page, len(ids), [rows[i] for i in page_ids if i in rows])
+    pagination.page_url = lambda num: url_for(endpoint, **{page_arg: num}, **values)
+    pagination.next_url = pagination.page_url(pagination.next_num) if pagination.has_next else None
+    pagination.prev_url = pagination.page_url(pagination.prev_num) if pagination.has_prev else None
+    return pagination
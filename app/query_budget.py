@@ -0,0 +1,24 @@
+from flask import g
+from flask_sqlalchemy import get_debug_queries
+
+def init_app(app):
+    """
+    When testing with MAX_QUERIES_PER_REQUEST set, fail any request that
+    issues more SQL statements than the budget (usually an N+1 lazy load).
+    """
+
+    limit = app.config.get('MAX_QUERIES_PER_REQUEST')
+    if not app.testing or not limit:
+        return
+
+    @app.before_request
+    def start_query_budget():
+        g.query_budget_start = len(get_debug_queries())
+
+    @app.after_request
+    def check_query_budget(response):
+        queries = get_debug_queries()[g.get('query_budget_start', 0):]
+        if len(queries) > limit:
+            statements = '\n'.join(q.statement for q in queries)
+            raise AssertionError(f'{len(queries)} queries exceeded the budget of {limit}:\n{statements}')
+        return response
@@ -0,0 +1,359 @@
+from flask import current_app
+from flask.cli import AppGroup
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
+from app.cache import make_cache, touch_render_generation
+from app.compiler import get_compiler, highlight_cache, slugify
+import click
+import json
+import os
+import time
+
+render_cli = AppGroup('posts', help='Maintain the rendered posts.')
+
+def init_app(app):
+    app.cli.add_command(render_cli)
+
+
+# Set in each worker process by _init_worker.
+_worker_cache = None
+
+def _init_worker(cache_type, max_bytes, path):
+    global _worker_cache
+    _worker_cache = make_cache(cache_type, max_bytes, path)
+
+def _render_batch(rows):
+    return _render(rows, _worker_cache)
+
+def _render(rows, cache):
+    """
+    Renders (id, title, markdown_body) rows, returning the columns that
+    prepare_to_save would have filled in for each.
+    """
+
+    compiler = get_compiler()
+    results = []
+    for id, title, markdown_body in rows:
+        compiled = compiler.compile(title, markdown_body or '', cache)
+        results.append((id, compiled.html, compiled.word_count, compiled.toc, compiled.summary))
+    return results
+
+
+def _render_batches(workers, batches):
+    """
+    Renders each (context, rows) in batches in a pool of workers, yielding
+    (context, results) in the order given. Batches are read and results
+    consumed in this process, with at most two batches per worker queued.
+    """
+
+    if workers <= 1:
+        cache = highlight_cache()
+        for context, rows in batches:
+            yield context, _render(rows, cache)
+        return
+
+    config = current_app.config
+    with Pool(workers, _init_worker, (config['HIGHLIGHT_CACHE_TYPE'],
+                                      config['HIGHLIGHT_CACHE_MAX_BYTES'],
+                                      config['HIGHLIGHT_CACHE_DIR'])) as pool:
+        pending = deque()
+        for context, rows in batches:
+            pending.append((context, pool.apply_async(_render_batch, (rows,))))
+            if len(pending) >= workers * 2:
+                context, result = pending.popleft()
+                yield context, result.get()
+        while pending:
+            context, result = pending.popleft()
+            yield context, result.get()
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def _write_checkpoint(path, last_id):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(str(last_id))
+    os.replace(tmp, path)
+
+
+@render_cli.command('render')
+@click.option('--workers', '-w', type=int, default=os.cpu_count() or 1, show_default=True,
+              help='Processes rendering markdown; 1 renders in this process.')
+@click.option('--batch-size', '-b', type=int, default=200, show_default=True,
+              help='Posts read, rendered and committed together.')
+@click.option('--resume/--restart', default=False,
+              help='Continue after the last batch committed by an interrupted run.')
+def render_command(workers, batch_size, resume):
+    """
+    Re-render the html, word count and table of contents of every post,
+    e.g. after changing the markdown extensions or highlight options.
+    Running workers pick up the new html through the render generation.
+    """
+
+    from app import db
+    from app.models import Post
+
+    checkpoint = current_app.config['RENDER_CHECKPOINT']
+    last_id = _read_checkpoint(checkpoint) if resume else 0
+    if last_id:
+        print(f'Resuming after post {last_id}.')
+
+    # Summaries are only derived when none was written, as prepare_to_save does.
+    missing_summary = set(id for id, in db.session.query(Post.id)
+                                               .filter(Post.id > last_id)
+                                               .filter((Post.summary == None) | (Post.summary == '')))
+
+    def batches(after):
+        while True:
+            rows = db.session.query(Post.id, Post.title, Post.markdown_body) \
+                             .filter(Post.id > after) \
+                             .order_by(Post.id) \
+                             .limit(batch_size).all()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield rows
+
+    def save(results):
+        db.session.bulk_update_mappings(Post, [
+            dict(id=id, html_body=html, word_count=word_count, toc=toc,
+                 **({ 'summary': summary } if id in missing_summary else {}))
+            for id, html, word_count, toc, summary in results])
+        db.session.commit()
+        _write_checkpoint(checkpoint, results[-1][0])
+
+    started = time.perf_counter()
+    done = 0
+
+    def report(results):
+        nonlocal done
+        done += len(results)
+        elapsed = time.perf_counter() - started
+        print(f'{done} posts rendered, up to id {results[-1][0]} ({done / elapsed:.1f} posts/s)')
+
+    for _, results in _render_batches(workers, ((None, rows) for rows in batches(last_id))):
+        save(results)
+        report(results)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    # The bulk updates skip the session events, so the cached pages and
+    # ETags of every worker are retired by moving to a new generation.
+    touch_render_generation()
+    for name in ('page_cache', 'fragment_cache'):
+        cache = current_app.extensions.get(name)
+        if cache is not None:
+            cache.clear()
+
+    elapsed = time.perf_counter() - started
+    print(f'Rendered {done} posts in {elapsed:.1f}s ({done / max(elapsed, 1e-6):.1f} posts/s).')
+
+
+def _read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise click.ClickException(f'{path}:{number}: {e}')
+
+def _read_markdown_dir(path):
+    """
+    Reads each .md file as a post. An optional header between --- lines
+    holds key: value fields; the title defaults to the file name.
+    """
+
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.md'):
+            continue
+        with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+            text = f.read()
+
+        record = { 'title': os.path.splitext(name)[0] }
+        if text.startswith('---\n'):
+            header, _, text = text[4:].partition('\n---\n')
+            for line in header.splitlines():
+                key, _, value = line.partition(':')
+                if value:
+                    record[key.strip()] = value.strip()
+        record['body'] = text
+        yield record
+
+def _parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _tag_titles(tags):
+    # Split the way Tag.validate_tags does, so a list entry with spaces
+    # becomes several tags rather than one that's never created.
+    if not isinstance(tags, str):
+        tags = ' '.join(str(tag) for tag in tags or ())
+    return set(filter(None, tags.split(' ')))
+
+
+@render_cli.command('import')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--author', '-a', required=True,
+              help='Username of the author of posts that don\'t name one.')
+@click.option('--workers', '-w', type=int, default=os.cpu_count() or 1, show_default=True,
+              help='Processes rendering markdown; 1 renders in this process.')
+@click.option('--batch-size', '-b', type=int, default=500, show_default=True,
+              help='Posts rendered and inserted together.')
+def import_command(path, author, workers, batch_size):
+    """
+    Import posts from a JSONL file or a directory of .md files. Each post
+    has a title and body, and optionally summary, tags, author,
+    date_published and date_edited. Posts whose title already exists are
+    skipped, so an interrupted import can be run again.
+    """
+
+    from app import db, search_cache
+    from app.models import Post, User, Tag, tag_to_post
+
+    authors = dict(db.session.query(User.username, User.id))
+    if author not in authors:
+        raise click.ClickException(f'No user named {author}.')
+
+    records = _read_markdown_dir(path) if os.path.isdir(path) else _read_jsonl(path)
+    seen = set()
+    skipped = 0
+
+    def batches():
+        nonlocal skipped
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return
+
+            titles = set(record.get('title') for record in batch)
+            existing = set(title for title, in db.session.query(Post.title).filter(Post.title.in_(titles)))
+            fresh = []
+            for record in batch:
+                title = record.get('title')
+                if not title or title in seen or title in existing:
+                    skipped += 1
+                    continue
+                seen.add(title)
+                fresh.append(record)
+
+            if fresh:
+                yield fresh, [(i, record['title'], record.get('body') or '') for i, record in enumerate(fresh)]
+
+    def save(batch, results):
+        now = datetime.utcnow()
+        rows = []
+        for record, (_, html, word_count, toc, summary) in zip(batch, results):
+            username = record.get('author') or author
+            if username not in authors:
+                print(f'No user named {username}, {record["title"]} is attributed to {author}.')
+                username = author
+            published = _parse_date(record.get('date_published')) or now
+            rows.append({
+                'title': record['title'],
+                'slug': slugify(record['title']),
+                'summary': record.get('summary') or summary,
+                'html_body': html,
+                'markdown_body': record.get('body') or '',
+                'toc': toc,
+                'word_count': word_count,
+                'date_published': published,
+                'date_edited': _parse_date(record.get('date_edited')) or published,
+                'user_id': authors[username]
+            })
+        db.session.execute(Post.__table__.insert(), rows)
+
+        ids = dict(db.session.query(Post.title, Post.id).filter(Post.title.in_([row['title'] for row in rows])))
+        tags = dict((tag.title, tag.id) for tag in
+                    Tag.validate_tags(' '.join(set().union(*[_tag_titles(record.get('tags')) for record in batch]))))
+        links = [{ 'post_id': ids[record['title']], 'tag_id': tags[title] }
+                 for record in batch for title in _tag_titles(record.get('tags'))]
+        if links:
+            db.session.execute(tag_to_post.insert(), links)
+        db.session.commit()
+
+    started = time.perf_counter()
+    done = 0
+    for batch, results in _render_batches(workers, batches()):
+        save(batch, results)
+        done += len(batch)
+        print(f'{done} posts imported ({done / (time.perf_counter() - started):.1f} posts/s)')
+
+    # Inserted rows don't go through the session events.
+    search_cache.clear()
+    print(f'Imported {done} posts in {time.perf_counter() - started:.1f}s, skipped {skipped}.')
+
+
+@render_cli.command('export')
+@click.argument('path', type=click.Path())
+@click.option('--batch-size', '-b', type=int, default=500, show_default=True,
+              help='Posts read from the database at a time.')
+def export_command(path, batch_size):
+    """
+    Export every post to PATH, as JSONL if it ends in .jsonl (or is -)
+    and otherwise as a directory of .md files, in the format read by
+    import. Posts are read in batches, never all at once.
+    """
+
+    from app import db
+    from app.models import Post, User, Tag, tag_to_post
+
+    def batches():
+        after = 0
+        while True:
+            rows = db.session.query(Post.id, Post.title, Post.slug, Post.summary, Post.markdown_body,
+                                    Post.date_published, Post.date_edited, User.username) \
+                             .outerjoin(User, Post.user_id == User.id) \
+                             .filter(Post.id > after) \
+                             .order_by(Post.id) \
+                             .limit(batch_size).all()
+            if not rows:
+                return
+            after = rows[-1].id
+
+            tags = {}
+            for post_id, title in db.session.query(tag_to_post.c.post_id, Tag.title) \
+                                            .join(Tag, Tag.id == tag_to_post.c.tag_id) \
+                                            .filter(tag_to_post.c.post_id.in_([row.id for row in rows])) \
+                                            .order_by(Tag.title):
+                tags.setdefault(post_id, []).append(title)
+            db.session.rollback()
+
+            for row in rows:
+                yield row, {
+                    'title': row.title,
+                    'summary': row.summary,
+                    'tags': tags.get(row.id, []),
+                    'author': row.username,
+                    'date_published': row.date_published.isoformat() if row.date_published else None,
+                    'date_edited': row.date_edited.isoformat() if row.date_edited else None,
+                    'body': row.markdown_body
+                }
+
+    done = 0
+    if path == '-' or path.endswith('.jsonl'):
+        with click.open_file(path, 'w', encoding='utf-8') as f:
+            for _, record in batches():
+                f.write(json.dumps(record) + '\n')
+                done += 1
+    else:
+        os.makedirs(path, exist_ok=True)
+        for row, record in batches():
+            body = record.pop('body') or ''
+            record['tags'] = ' '.join(record['tags'])
+            header = ''.join(f'{key}: {" ".join(str(value).split())}\n'
+                             for key, value in record.items() if value)
+            with open(os.path.join(path, f'{row.id}-{row.slug}.md'), 'w', encoding='utf-8') as f:
+                f.write(f'---\n{header}---\n{body}')
+            done += 1
+
+    if path != '-':
+        print(f'Exported {done} posts.')
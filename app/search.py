@@ -0,0 +1,162 @@
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import MetaData, Table, Column, Integer, Text, Float, func, false, literal, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy_searchable import search as tsvector_search, sync_trigger
+import re
+
+# Without Postgres the search vector column is unused; let it exist as text.
+@compiles(TSVECTOR, 'sqlite')
+def compile_tsvector_sqlite(type_, compiler, **kw):
+    return 'TEXT'
+
+
+class PostgresSearch(object):
+    """
+    Full text search with the post's tsvector column, which is kept up to
+    date by the trigger from the init migration.
+    """
+
+    def filter(self, query, search_query):
+        return tsvector_search(query, search_query)
+
+    def rank(self, search_query):
+        from app.models import Post
+        return func.ts_rank_cd(Post.search_vector, func.tsq_parse(search_query), type_=Float)
+
+    def rebuild(self, connection):
+        from app.models import Post
+        sync_trigger(connection, 'post', 'search_vector', ['title', 'summary', 'markdown_body'],
+                     options=Post.__table__.c.search_vector.type.options)
+
+
+# Not part of db.metadata so that create_all and autogenerate leave it alone.
+post_fts = Table('post_fts', MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('post_fts', Text))
+
+class SQLiteSearch(object):
+    """
+    Full text search with an FTS5 index over the post table, kept in sync
+    by triggers. The title/summary/body columns are weighted like the
+    tsvector's A/B/C weights.
+    """
+
+    weights = (1.0, 0.4, 0.2)
+
+    ddl = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+            title, summary, markdown_body,
+            content='post', content_rowid='id', tokenize='porter unicode61')
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+            INSERT INTO post_fts(rowid, title, summary, markdown_body)
+            VALUES (new.id, new.title, new.summary, new.markdown_body);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, summary, markdown_body)
+            VALUES ('delete', old.id, old.title, old.summary, old.markdown_body);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, summary, markdown_body ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, summary, markdown_body)
+            VALUES ('delete', old.id, old.title, old.summary, old.markdown_body);
+            INSERT INTO post_fts(rowid, title, summary, markdown_body)
+            VALUES (new.id, new.title, new.summary, new.markdown_body);
+        END
+        """
+    ]
+
+    def filter(self, query, search_query):
+        if not search_query.strip():
+            return query
+
+        from app.models import Post
+        match = to_fts5_query(search_query)
+        if match is None:
+            return query.filter(false())
+        return query.join(post_fts, post_fts.c.rowid == Post.id) \
+                    .filter(post_fts.c.post_fts.op('MATCH')(match))
+
+    def rank(self, search_query):
+        # Without terms filter doesn't join post_fts, so there's nothing for
+        # bm25 to score and every post ranks the same.
+        if not search_query.strip() or to_fts5_query(search_query) is None:
+            return literal(0.0, type_=Float)
+        # bm25 is lower for better matches; negate it to sort like ts_rank_cd.
+        return -func.bm25(text('post_fts'), *self.weights, type_=Float)
+
+    def rebuild(self, connection):
+        for statement in self.ddl:
+            connection.execute(statement)
+        connection.execute("INSERT INTO post_fts(post_fts) VALUES('rebuild')")
+
+
+def to_fts5_query(search_query):
+    """
+    Translates the search box syntax handled by tsq_parse on Postgres
+    (prefix matched words, "phrases", -negation and or) into an FTS5
+    query. Returns None if nothing searchable is left.
+    """
+
+    groups = [[]]
+    negate = False
+    for phrase, word in re.findall(r'"([^"]*)"|([^\s"()]+)', search_query.lower()):
+        if word == 'or':
+            groups.append([])
+            continue
+        if word.startswith('-'):
+            negate = True
+            word = word.lstrip('-')
+
+        terms = re.findall(r'\w+', phrase or word)
+        if terms:
+            term = '"' + ' '.join(terms) + '"' + ('' if phrase else '*')
+            groups[-1].append((negate, term))
+            negate = False
+
+    expressions = []
+    for group in groups:
+        positive = [term for negated, term in group if not negated]
+        if not positive:
+            continue
+        expression = ' AND '.join(positive)
+        for negated, term in group:
+            if negated:
+                expression += ' NOT ' + term
+        expressions.append('(' + expression + ')')
+
+    return ' OR '.join(expressions) or None
+
+
+backends = {
+    'postgresql': PostgresSearch,
+    'sqlite': SQLiteSearch
+}
+
+def search_backend():
+    return current_app.extensions['search']
+
+def init_app(app):
+    name = app.config['SEARCH_BACKEND']
+    if not name:
+        name = 'sqlite' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') else 'postgresql'
+    app.extensions['search'] = backends[name]()
+    app.cli.add_command(search_cli)
+
+
+search_cli = AppGroup('search', help='Manage the post search index.')
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Recreate the search index and its triggers and reindex every post."""
+    from app import db
+    with db.engine.begin() as connection:
+        search_backend().rebuild(connection)
+    print('Search index rebuilt.')
@@ -0,0 +1,143 @@
+from flask import current_app, has_app_context, has_request_context, request
+from logging.handlers import RotatingFileHandler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from threading import Lock
+from datetime import datetime
+from app.logs import queue_handler
+import json
+import logging
+import os
+import time
+
+class SlowQueryFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.slow_query, default=str)
+
+
+class SlowQueryRecorder(object):
+    """
+    Logs statements that take longer than SLOW_QUERY_THRESHOLD seconds as
+    JSON lines in SLOW_QUERY_LOG, with their parameters, the request that
+    ran them and the database's plan for them.
+
+    The plan is captured on the statement's own connection right after it
+    runs, with EXPLAIN (ANALYZE, BUFFERS) for Postgres selects (plain
+    EXPLAIN for anything else, which ANALYZE could run twice) and
+    EXPLAIN QUERY PLAN for SQLite. Each distinct statement is explained at
+    most once per SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+
+    The Engine listeners and the log's handler are shared by every app, so
+    they're added once and statements go to the current app's recorder.
+    """
+
+    def __init__(self, app):
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD']
+        self.explain_interval = app.config['SLOW_QUERY_EXPLAIN_INTERVAL']
+        self._explained = {}
+        self._lock = Lock()
+
+        path = app.config['SLOW_QUERY_LOG']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        file_handler = RotatingFileHandler(path, maxBytes=app.config['LOG_MAX_BYTES'],
+                                           backupCount=app.config['LOG_BACKUP_COUNT'])
+        file_handler.setFormatter(SlowQueryFormatter())
+
+        self.logger = logging.getLogger('app.slow_queries')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            self.logger.addHandler(queue_handler(file_handler))
+        else:
+            file_handler.close()
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_execute)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if elapsed < self.threshold:
+            return
+
+        record = {
+            'time': datetime.utcnow().isoformat(),
+            'duration_ms': round(elapsed * 1000, 2),
+            'statement': statement,
+            'parameters': parameters,
+            'executemany': executemany
+        }
+        if has_request_context():
+            record.update(endpoint=request.endpoint, method=request.method, path=request.full_path)
+        if not executemany and self._should_explain(statement):
+            record['plan'] = self.explain(conn, statement, parameters)
+        self.logger.info('slow query', extra={ 'slow_query': record })
+
+    def _should_explain(self, statement):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(statement, -self.explain_interval) < self.explain_interval:
+                return False
+            if len(self._explained) > 1000:
+                self._explained.clear()
+            self._explained[statement] = now
+        return True
+
+    def explain(self, conn, statement, parameters):
+        dialect = conn.dialect.name
+        verb = (statement.split(None, 1) or [''])[0].upper()
+        if verb not in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE'):
+            return None
+        if dialect == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if verb == 'SELECT' else 'EXPLAIN '
+        elif dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            return None
+
+        # Run on the raw connection, so neither these listeners nor the
+        # session see it, inside a savepoint so a failure can't abort the
+        # surrounding Postgres transaction.
+        cursor = conn.connection.cursor()
+        saved = False
+        try:
+            try:
+                if dialect == 'postgresql':
+                    cursor.execute('SAVEPOINT slow_query_explain')
+                    saved = True
+                cursor.execute(prefix + statement, parameters)
+                plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+            except Exception as e:
+                if saved:
+                    cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return f'EXPLAIN failed: {e}'
+            if saved:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        finally:
+            cursor.close()
+
+
+def _recorder():
+    return current_app.extensions.get('slow_queries') if has_app_context() else None
+
+def _before_execute(*args):
+    recorder = _recorder()
+    if recorder is not None:
+        recorder.before_execute(*args)
+
+def _after_execute(*args):
+    recorder = _recorder()
+    if recorder is not None:
+        recorder.after_execute(*args)
+
+
+def init_app(app):
+    if app.config['SLOW_QUERY_THRESHOLD'] is not None:
+        app.extensions['slow_queries'] = SlowQueryRecorder(app)
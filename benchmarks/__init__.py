@@ -0,0 +1,10 @@
+"""
+Benchmarks for the blog. Run from the repository root, next to config.json:
+
+    python -m benchmarks run --database-uri sqlite:////tmp/bench.db --save baseline.json
+    python -m benchmarks run --database-uri sqlite:////tmp/bench.db --baseline baseline.json
+
+The database is migrated and seeded with a synthetic corpus the first
+time, then every scenario is timed through the Flask test client (or a
+local WSGI server with --client wsgi).
+"""
@@ -0,0 +1,290 @@
+from benchmarks.corpus import Corpus
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from threading import Thread
+from urllib import parse, request as urllib_request
+from urllib.error import HTTPError
+from werkzeug.serving import make_server
+import click
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+PASSWORD = 'benchmark'
+
+def make_config(database_uri, caches):
+    from config import Config
+
+    class BenchmarkConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = database_uri
+        MAIL_QUEUE = False
+        MAIL_SUPPRESS_SEND = True
+
+    if not caches:
+        for name in ('PAGE', 'FRAGMENT', 'SEARCH', 'HIGHLIGHT', 'USER'):
+            setattr(BenchmarkConfig, f'{name}_CACHE_TYPE', None)
+    return BenchmarkConfig
+
+
+def seed(app, corpus):
+    """Migrates the database and imports the corpus unless it has posts already."""
+
+    from flask_migrate import upgrade
+    from app import db
+    from app.models import User, UserLevel, Post
+
+    with app.app_context():
+        upgrade(directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations'))
+        if Post.query.first() != None:
+            return
+
+        for username in corpus.usernames:
+            user = User(username=username, name=username.title(), is_verified=True, level=UserLevel.admin)
+            user.set_password(PASSWORD)
+            db.session.add(user)
+        db.session.commit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'corpus.jsonl')
+        corpus.write_jsonl(path)
+        result = app.test_cli_runner().invoke(args=['posts', 'import', path, '-a', corpus.usernames[0], '-w', '1'])
+        if result.exit_code != 0:
+            raise click.ClickException(f'Seeding failed:\n{result.output}')
+
+
+class TestClient(object):
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class WSGIClient(object):
+    """Requests over HTTP to a werkzeug server in a background thread."""
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.opener = urllib_request.build_opener(urllib_request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, data=None):
+        body = parse.urlencode(data).encode('utf-8') if data is not None else None
+        try:
+            with self.opener.open(urllib_request.Request(self.base + path, body, method=method)) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+
+def listing_urls(app, rows, pages):
+    """
+    The first pages of the home page listing, newest first. In keyset mode
+    each page after the first needs the cursor of the previous one.
+    """
+
+    from app.pagination import encode_cursor
+
+    per_page = app.config['POSTS_PER_PAGE']
+    rows = sorted(rows, key=lambda row: (row.date_published, row.id), reverse=True)
+    urls = ['/']
+    for page in range(2, min(pages, math.ceil(len(rows) / per_page)) + 1):
+        values = { 'page': page }
+        if app.config['POSTS_PAGINATION_MODE'] != 'offset':
+            last = rows[(page - 1) * per_page - 1]
+            values = { 'after': encode_cursor([last.date_published, last.id]), 'page': page }
+        urls.append('/?' + parse.urlencode(values))
+    return urls
+
+
+def scenarios(state):
+    """Each scenario returns the (method, path, data) of its next request."""
+
+    corpus = state['corpus']
+
+    def tag_query(rng, count):
+        return ' '.join(corpus.post_tags(rng)[:count] or corpus.tags[:1])
+
+    def edit(rng):
+        post_id = rng.choice(state['ids'])
+        return 'POST', f'/cms/edit?id={post_id}', {
+            'title': state['titles'][post_id],
+            'body': corpus.body(rng),
+            'tags': ' '.join(corpus.post_tags(rng)),
+            'summary': ''
+        }
+
+    def create(rng):
+        state['created'] += 1
+        return 'POST', '/cms/create', {
+            'title': f'Benchmark {state["run"]} {state["created"]}',
+            'body': corpus.body(rng),
+            'tags': ' '.join(corpus.post_tags(rng)),
+            'summary': ''
+        }
+
+    return [
+        ('main.index', False, lambda rng: ('GET', rng.choice(state['listing_urls']), None)),
+        ('main.blog', False, lambda rng: ('GET', f'/blog/{rng.choice(state["slugs"])}', None)),
+        ('search.text', False, lambda rng: ('GET', '/search?' + parse.urlencode(
+            { 'q': corpus.sentence(rng, rng.randint(1, 2)) }), None)),
+        ('search.tags_all', False, lambda rng: ('GET', '/search?' + parse.urlencode(
+            { 't': tag_query(rng, 2), 'all': 1 }), None)),
+        ('search.tags_any', False, lambda rng: ('GET', '/search?' + parse.urlencode(
+            { 't': tag_query(rng, 3) }), None)),
+        ('cms.blog_create', True, create),
+        ('cms.blog_edit', True, edit)
+    ]
+
+
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def measure(client, make_request, rng, requests, warmup, concurrency):
+    for _ in range(warmup):
+        client.request(*make_request(rng))
+
+    def timed(request):
+        start = time.perf_counter()
+        status = client.request(*request)
+        return time.perf_counter() - start, status
+
+    planned = [make_request(rng) for _ in range(requests)]
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, planned))
+    else:
+        results = [timed(request) for request in planned]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rps': round(requests / elapsed, 2)
+    }
+
+
+def compare(results, baseline, max_regression):
+    regressed = []
+    print(f'\n{"scenario":<18}{"p50 ms":>18}{"p95 ms":>18}{"p99 ms":>18}{"req/s":>18}')
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            if base is None or not base.get(key):
+                cells.append(f'{result[key]:>18}')
+                continue
+            change = (result[key] - base[key]) / base[key] * 100
+            cells.append(f'{result[key]:>10} {change:>+6.1f}%')
+            worse = -change if key == 'rps' else change
+            if max_regression is not None and key in ('p95_ms', 'rps') and worse > max_regression:
+                regressed.append(f'{name} {key}')
+        print(f'{name:<18}' + ''.join(cells))
+    return regressed
+
+
+@click.group()
+def cli():
+    """Seed a synthetic corpus and time the blog's main pages against it."""
+
+
+@cli.command('run')
+@click.option('--database-uri', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'blog-benchmark.db'),
+              show_default=True, help='SQLite or Postgres database to seed and benchmark.')
+@click.option('--posts', default=1000, show_default=True)
+@click.option('--users', default=5, show_default=True)
+@click.option('--tags', default=200, show_default=True)
+@click.option('--seed', 'seed_value', default=0, show_default=True, help='Seed for the corpus and requests.')
+@click.option('--requests', '-n', default=200, show_default=True, help='Timed requests per scenario.')
+@click.option('--warmup', default=20, show_default=True, help='Untimed requests per scenario.')
+@click.option('--client', type=click.Choice(['test', 'wsgi']), default='test', show_default=True)
+@click.option('--concurrency', '-c', default=1, show_default=True, help='Parallel requests (wsgi client only).')
+@click.option('--caches/--no-caches', default=True, help='Run with the page, fragment and search caches.')
+@click.option('--listing-pages', default=20, show_default=True, help='Home page listing pages to spread requests over.')
+@click.option('--only', multiple=True, help='Run just these scenarios.')
+@click.option('--save', type=click.Path(), help='Write the results as a baseline.')
+@click.option('--baseline', type=click.Path(exists=True), help='Compare against a saved baseline.')
+@click.option('--max-regression', type=float,
+              help='Exit with an error if p95 or req/s is this many percent worse than the baseline.')
+def run_command(database_uri, posts, users, tags, seed_value, requests, warmup, client, concurrency,
+                caches, listing_pages, only, save, baseline, max_regression):
+    """Seed the database if it's empty, then time each scenario."""
+
+    from app import create_app
+    from app.models import Post
+
+    app = create_app(make_config(database_uri, caches))
+    corpus = Corpus(posts=posts, users=users, tags=tags, seed=seed_value)
+    seed(app, corpus)
+
+    with app.app_context():
+        rows = Post.query.with_entities(Post.id, Post.slug, Post.title, Post.date_published).all()
+    state = {
+        'corpus': corpus,
+        'ids': [row.id for row in rows],
+        'slugs': [row.slug for row in rows],
+        'titles': dict((row.id, row.title) for row in rows),
+        'listing_urls': listing_urls(app, rows, listing_pages),
+        'run': int(time.time()),
+        'created': 0
+    }
+
+    clients = {}
+    def get_client(logged_in):
+        if logged_in not in clients:
+            clients[logged_in] = WSGIClient(app) if client == 'wsgi' else TestClient(app)
+            if logged_in:
+                clients[logged_in].request('POST', '/cms/login',
+                                           { 'username': corpus.usernames[0], 'password': PASSWORD })
+        return clients[logged_in]
+
+    if concurrency > 1 and client != 'wsgi':
+        raise click.UsageError('--concurrency needs --client wsgi.')
+
+    results = {}
+    for name, logged_in, make_request in scenarios(state):
+        if only and name not in only:
+            continue
+        rng = random.Random(f'{seed_value}-{name}')
+        results[name] = measure(get_client(logged_in), make_request, rng, requests, warmup, concurrency)
+        result = results[name]
+        print(f'{name:<18} p50 {result["p50_ms"]:>9} ms  p95 {result["p95_ms"]:>9} ms  '
+              f'p99 {result["p99_ms"]:>9} ms  {result["rps"]:>9} req/s  {result["errors"]} errors')
+
+    report = {
+        'settings': { 'database': database_uri.split(':', 1)[0], 'posts': posts, 'users': users, 'tags': tags,
+                      'seed': seed_value, 'requests': requests, 'client': client, 'listing_pages': listing_pages,
+                      'concurrency': concurrency, 'caches': caches },
+        'scenarios': results
+    }
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != report['settings']:
+            print('\nThe baseline was recorded with different settings:', baseline.get('settings'))
+        regressed = compare(results, baseline, max_regression)
+        if regressed:
+            print('\nRegressed: ' + ', '.join(regressed))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,74 @@
+import json
+import random
+
+LANGUAGES = [
+    ('python', ['def {0}({1}):', '    return {1} + {2}', 'for {0} in range({2}):', '    print({1})']),
+    ('javascript', ['function {0}({1}) {{', '  return {1} * {2};', '}}', 'const {0} = [{1}, {2}];']),
+    ('c', ['int {0}(int {1}) {{', '    return {1} << {2};', '}}', 'printf("%d", {0});'])
+]
+
+class Corpus(object):
+    """
+    Deterministic synthetic posts for benchmarking. Words and tags are
+    both drawn with Zipf distributed frequencies, so a few tags are on
+    most posts and searches hit a realistic mix of common and rare terms.
+    """
+
+    def __init__(self, posts=1000, users=5, tags=200, seed=0, zipf=1.1):
+        self.posts = posts
+        self.users = users
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'en', 'ar', 'ol', 'dex', 'py', 'qu']
+        words = set()
+        while len(words) < 3000:
+            words.add(''.join(self.rng.choice(syllables) for _ in range(self.rng.randint(1, 4))))
+        self.words = sorted(words)
+        self.rng.shuffle(self.words)
+        self.word_weights = _zipf_weights(len(self.words), zipf)
+
+        self.tags = [f'{word}-{i}' for i, word in enumerate(self.words[:tags])]
+        self.tag_weights = _zipf_weights(len(self.tags), zipf)
+
+        self.usernames = [f'bench{i}' for i in range(users)]
+
+    def sentence(self, rng, length):
+        return ' '.join(rng.choices(self.words, self.word_weights, k=length))
+
+    def body(self, rng):
+        parts = []
+        for _ in range(rng.randint(3, 10)):
+            roll = rng.random()
+            if roll < 0.15:
+                parts.append('## ' + self.sentence(rng, rng.randint(2, 5)).capitalize())
+            elif roll < 0.35:
+                language, lines = rng.choice(LANGUAGES)
+                names = rng.sample(self.words, 3)
+                code = '\n'.join(line.format(*names) for line in rng.sample(lines, rng.randint(2, len(lines))))
+                parts.append(f'```{language}\n{code}\n```')
+            else:
+                parts.append(self.sentence(rng, rng.randint(40, 120)).capitalize() + '.')
+        return '\n\n'.join(parts)
+
+    def post_tags(self, rng):
+        return sorted(set(rng.choices(self.tags, self.tag_weights, k=rng.randint(1, 5))))
+
+    def records(self):
+        rng = random.Random(self.seed + 1)
+        for i in range(self.posts):
+            yield {
+                'title': f'{self.sentence(rng, rng.randint(2, 6)).capitalize()} {i}',
+                'tags': self.post_tags(rng),
+                'author': self.usernames[i % len(self.usernames)],
+                'body': self.body(rng)
+            }
+
+    def write_jsonl(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in self.records():
+                f.write(json.dumps(record) + '\n')
+
+
+def _zipf_weights(count, exponent):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
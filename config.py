@@ -15,8 +15,63 @@ class Config(object):
     MAIL_USERNAME = _config['mail'].get('username')
     MAIL_PASSWORD = _config['mail'].get('password')
     MAIL_SUPPRESS_SEND = False
+    MAIL_QUEUE = _config['mail'].get('queue', True)
+    MAIL_SPOOL_DIR = _config['mail'].get('spool_dir') or os.path.join(_basedir, 'spool', 'mail')
+    MAIL_IDLE_TIMEOUT = _config['mail'].get('idle_timeout', 30)
+    MAIL_RETRY_DELAY = _config['mail'].get('retry_delay', 5)
+    MAIL_MAX_RETRIES = _config['mail'].get('max_retries', 6)
     ADMINS = _config['admins']
     RECAPTCHA_PUBLIC_KEY = _config['recaptcha']['public']
     RECAPTCHA_PRIVATE_KEY = _config['recaptcha']['private']
     RECAPTCHA_USE_SSL = _config['recaptcha']['use_ssl']
-    POSTS_PER_PAGE = 5
\ No newline at end of file
+    LOG_MAX_BYTES = _config.get('log_max_bytes', 10 * 1024 * 1024)
+    LOG_BACKUP_COUNT = _config.get('log_backup_count', 10)
+    LOG_DIGEST_INTERVAL = _config.get('log_digest_interval', 300)
+    POSTS_PER_PAGE = 5
+    FEED_LENGTH = _config.get('feed_length', 20)
+    POSTS_PAGINATION_MODE = _config.get('pagination_mode', 'keyset')
+    POSTS_PAGINATION_COUNT = _config.get('pagination_count', False)
+    MAX_QUERIES_PER_REQUEST = None
+    AVATAR_SIZES = _config.get('avatar_sizes', [100, 200, 400])
+    AVATAR_MAX_BYTES = _config.get('avatar_max_bytes', 5 * 1024 * 1024)
+    AVATAR_MAX_PIXELS = _config.get('avatar_max_pixels', 4096 * 4096)
+    AVATAR_WEBP_QUALITY = _config.get('avatar_webp_quality', 85)
+    AVATAR_WORKERS = _config.get('avatar_workers', 2)
+    ASSETS_FINGERPRINT = _config.get('assets_fingerprint', True)
+    COMPRESS_ENABLED = _config.get('compress_enabled', True)
+    COMPRESS_MIN_SIZE = _config.get('compress_min_size', 500)
+    COMPRESS_GZIP_LEVEL = _config.get('compress_gzip_level', 6)
+    COMPRESS_BROTLI_QUALITY = _config.get('compress_brotli_quality', 5)
+    COMPRESS_MIMETYPES = _config.get('compress_mimetypes', ['text/html', 'text/css', 'text/plain', 'text/xml',
+                                                            'application/json', 'application/javascript',
+                                                            'application/xml', 'application/rss+xml',
+                                                            'application/atom+xml', 'application/feed+json',
+                                                            'image/svg+xml'])
+    METRICS_ENABLED = _config.get('metrics_enabled', True)
+    SLOW_QUERY_THRESHOLD = _config.get('slow_query_threshold')
+    SLOW_QUERY_EXPLAIN_INTERVAL = _config.get('slow_query_explain_interval', 300)
+    SLOW_QUERY_LOG = _config.get('slow_query_log') or os.path.join('logs', 'slow_queries.log')
+    ETAG_VERSION = _config.get('etag_version', '')
+    TAG_ID_CACHE_SIZE = 10000
+    SEARCH_BACKEND = _config.get('search_backend')
+    PAGE_CACHE_TYPE = _config.get('page_cache_type', 'lru')
+    PAGE_CACHE_DIR = _config.get('page_cache_dir') or os.path.join(_basedir, 'cache', 'pages')
+    PAGE_CACHE_MAX_BYTES = _config.get('page_cache_max_bytes', 32 * 1024 * 1024)
+    FRAGMENT_CACHE_TYPE = _config.get('fragment_cache_type', 'lru')
+    FRAGMENT_CACHE_DIR = _config.get('fragment_cache_dir') or os.path.join(_basedir, 'cache', 'fragments')
+    FRAGMENT_CACHE_MAX_BYTES = _config.get('fragment_cache_max_bytes', 8 * 1024 * 1024)
+    SEARCH_CACHE_TYPE = _config.get('search_cache_type', 'lru')
+    SEARCH_CACHE_DIR = _config.get('search_cache_dir') or os.path.join(_basedir, 'cache', 'searches')
+    SEARCH_CACHE_MAX_BYTES = _config.get('search_cache_max_bytes', 8 * 1024 * 1024)
+    SEARCH_CACHE_TTL = _config.get('search_cache_ttl', 300)
+    HIGHLIGHT_CACHE_TYPE = _config.get('highlight_cache_type', 'lru')
+    HIGHLIGHT_CACHE_DIR = _config.get('highlight_cache_dir') or os.path.join(_basedir, 'cache', 'highlight')
+    HIGHLIGHT_CACHE_MAX_BYTES = _config.get('highlight_cache_max_bytes', 16 * 1024 * 1024)
+    USER_CACHE_TYPE = _config.get('user_cache_type', 'lru')
+    USER_CACHE_DIR = _config.get('user_cache_dir') or os.path.join(_basedir, 'cache', 'users')
+    USER_CACHE_MAX_BYTES = _config.get('user_cache_max_bytes', 1024 * 1024)
+    USER_CACHE_TTL = _config.get('user_cache_ttl', 60)
+    FREEZE_DIR = _config.get('freeze_dir')
+    FREEZE_INCREMENTAL = _config.get('freeze_incremental', True)
+    RENDER_CHECKPOINT = _config.get('render_checkpoint') or os.path.join(_basedir, 'cache', 'render.checkpoint')
+    RENDER_GENERATION = _config.get('render_generation') or os.path.join(_basedir, 'cache', 'render.generation')
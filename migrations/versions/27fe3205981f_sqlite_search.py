@@ -0,0 +1,59 @@
+"""sqlite search
+
+Revision ID: 27fe3205981f
+Revises: 651d15191819
+Create Date: 2026-10-18 12:20:48.113094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '27fe3205981f'
+down_revision = '651d15191819'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Postgres searches the tsvector column; only SQLite needs an index here.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("""
+        CREATE VIRTUAL TABLE post_fts USING fts5(
+            title, summary, markdown_body,
+            content='post', content_rowid='id', tokenize='porter unicode61')
+    """)
+    op.execute("""
+        CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN
+            INSERT INTO post_fts(rowid, title, summary, markdown_body)
+            VALUES (new.id, new.title, new.summary, new.markdown_body);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, summary, markdown_body)
+            VALUES ('delete', old.id, old.title, old.summary, old.markdown_body);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER post_fts_update AFTER UPDATE OF title, summary, markdown_body ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, summary, markdown_body)
+            VALUES ('delete', old.id, old.title, old.summary, old.markdown_body);
+            INSERT INTO post_fts(rowid, title, summary, markdown_body)
+            VALUES (new.id, new.title, new.summary, new.markdown_body);
+        END
+    """)
+    op.execute("INSERT INTO post_fts(post_fts) VALUES('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('DROP TRIGGER post_fts_update')
+    op.execute('DROP TRIGGER post_fts_delete')
+    op.execute('DROP TRIGGER post_fts_insert')
+    op.execute('DROP TABLE post_fts')
@@ -59,6 +59,11 @@ def upgrade():
     sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
     sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], )
     )
+    if op.get_bind().dialect.name != 'postgresql':
+        # The tsvector trigger and tsq_parse are Postgres only; SQLite
+        # gets its FTS5 index from the sqlite_search migration.
+        return
+
     sync_trigger(op.get_bind(), 'post', 'search_vector', ['title', 'summary', 'markdown_body'])
     op.execute("""
         DROP TYPE IF EXISTS tsq_state CASCADE;
@@ -297,5 +302,6 @@ def downgrade():
     op.drop_table('user')
     op.drop_index(op.f('ix_tag_title'), table_name='tag')
     op.drop_table('tag')
-    op.execute('DROP TYPE public.userlevel')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP TYPE public.userlevel')
     # ### end Alembic commands ###